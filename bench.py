@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# bench.py
+# This file is part of DR StratComp.
+#
+# Copyright (C) 2010 - Stéphane Caron
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import argparse
+import json
+import multiprocessing
+import numpy
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from scheduling import LoadProfile, Scenario
+from strats import aloha, game, timeslack, uniform
+import scenarios
+
+"""Scaling benchmarks of the strategies and of the core scheduler.
+
+Each case runs in a fresh worker process on synthetic scenarios written in the
+settings/ format. Timings and peak memory are written as JSON and can be
+compared against a baseline file, e.g.:
+
+    % python bench.py --output bench.json --baseline bench_baseline.json
+
+"""
+
+
+JOBS = [10, 100, 1000, 10000, 100000]
+SLOTS = [36, 144, 1440]
+
+# Cases whose estimated work exceeds this budget are skipped. Work is counted
+# in elementary Python-level steps, see the work functions of CASES.
+
+MAX_WORK = 5e7
+
+
+def write_settings(path, nb_jobs, nb_slots, seed=42):
+    """Write a synthetic scenario in the settings/ format.
+
+    Jobs are split among (at most) ten packs, with durations up to half the
+    horizon and log-normal instant costs. L is chosen so that the
+    non-triviality criterion holds.
+
+    Arguments:
+    path -- output file
+    nb_jobs -- total number of jobs
+    nb_slots -- number of time slots
+    seed -- seed of the pack parameters
+
+    """
+    rs = numpy.random.RandomState(seed)
+    nb_packs = min(10, nb_jobs)
+    nums = [nb_jobs / nb_packs + (k < nb_jobs % nb_packs)
+            for k in range(nb_packs)]
+    taus = rs.randint(1, max(2, nb_slots / 2), nb_packs)
+    costs = numpy.round(rs.lognormal(3., 1., nb_packs), 2)
+    area = sum(n * tau * d for (n, tau, d) in zip(nums, taus, costs))
+    f = open(path, 'w')
+    f.write('L = %f kW\n' % (area / nb_slots / 1.2))
+    f.write('nb_slots = %d slots\n' % nb_slots)
+    f.write('C0 = 2.8e-6 $/kW/s\n')
+    f.write('C1 = 2.8e-8 $/kW^2/s\n\n')
+    f.write('%d\n' % nb_packs)
+    for (n, tau, d) in zip(nums, taus, costs):
+        f.write('%d %d %.2f\n' % (n, tau, d))
+    f.close()
+
+################################################################################
+
+def _schedule(make_sched):
+    def setup(scenario):
+        return make_sched(scenario)
+    def run(sched):
+        sched.schedule_tasks()
+    return setup, run
+
+def _global_cost():
+    def setup(scenario):
+        sched = uniform.Scheduler(scenario)
+        sched.schedule_tasks()
+        return sched
+    def run(sched):
+        sched._cost_prefix = (None, None)
+        sched.get_global_cost()
+    return setup, run
+
+def _add_load():
+    def setup(scenario):
+        tasks = scenario.tasks
+        slots = [random.randint(0, scenario.nb_slots - task.nb_slots)
+                 for task in tasks]
+        return scenario, tasks, slots
+    def run(state):
+        scenario, tasks, slots = state
+        profile = LoadProfile(scenario)
+        for (task, slot) in zip(tasks, slots):
+            profile.add_load(task.nb_slots, task.inst_cost, slot)
+    return setup, run
+
+def _batch(sample_loads):
+    def setup(scenario):
+        return scenario
+    def run(scenario):
+        sample_loads(scenario)
+    return setup, run
+
+
+# name -> ((setup, run), work(nb_jobs, nb_slots))
+
+CASES = {
+    'uniform': (_schedule(uniform.Scheduler), lambda N, S: N),
+    'aloha': (_schedule(lambda sc: aloha.Scheduler(.2, 0, sc)),
+              lambda N, S: N * S),
+    'timeslack': (_schedule(lambda sc: timeslack.Scheduler(.06, sc)),
+                  lambda N, S: N * S),
+    'game': (_schedule(lambda sc: game.Scheduler(2, sc)),
+             lambda N, S: 3 * N * (100 + S / 10)),
+    'global_cost': (_global_cost(), lambda N, S: N + S),
+    'add_load': (_add_load(), lambda N, S: N),
+    'uniform_batch': (_batch(lambda sc: uniform.sample_loads(100, sc)),
+                      lambda N, S: 100 * S),
+    'aloha_batch': (_batch(lambda sc: aloha.sample_loads(.2, 0, 100, sc)),
+                    lambda N, S: 100 * S),
+    'timeslack_batch': (_batch(lambda sc: timeslack.sample_loads(.06, 100,
+                                                                 sc)),
+                        lambda N, S: 100 * S),
+}
+
+################################################################################
+
+def _rss_kb():
+    """Current resident set size of the process, in kB."""
+    f = open('/proc/self/statm')
+    try:
+        pages = int(f.read().split()[1])
+    finally:
+        f.close()
+    return pages * resource.getpagesize() / 1024
+
+def _run_case(args):
+    """Time a case in the current (fresh) worker process."""
+    name, path, repeat = args
+    (setup, run), _ = CASES[name]
+    random.seed(42)
+    numpy.random.seed(42)
+    rss_start = _rss_kb()
+    scenario = Scenario.from_file(os.path.basename(path),
+                                  os.path.dirname(path))
+    times = []
+    for i in range(repeat):
+        state = setup(scenario)
+        start = time.time()
+        run(state)
+        times.append(time.time() - start)
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return min(times), max(times) - min(times), max(0, peak_kb - rss_start)
+
+def write_heavy_tailed(path, nb_jobs, nb_slots, seed=42):
+    """Write a synthetic scenario with heavy-tailed durations and loads."""
+    scenarios.generate(path, nb_jobs, nb_slots, seed)
+
+def run_benchmarks(cases, jobs, slots, repeat=5, max_work=MAX_WORK,
+                   generator=write_settings):
+    """Run a grid of benchmark cases.
+
+    Arguments:
+    cases -- names of cases (keys of CASES)
+    jobs -- list of job counts
+    slots -- list of slot counts
+    repeat -- number of timed runs per point (the best one is kept, with
+        the spread between the best and worst ones)
+    max_work -- skip points whose estimated work exceeds this budget
+    generator -- function writing the scenario of each point
+
+    Returns a list of result dictionaries.
+
+    """
+    tmpdir = tempfile.mkdtemp(prefix='bench')
+    results = []
+    try:
+        for nb_slots in slots:
+            for nb_jobs in jobs:
+                path = os.path.join(tmpdir, 'bench_%d_%d.in' % (nb_jobs,
+                                                                nb_slots))
+                generator(path, nb_jobs, nb_slots)
+                for name in cases:
+                    result = {'case': name, 'jobs': nb_jobs,
+                              'slots': nb_slots}
+                    if CASES[name][1](nb_jobs, nb_slots) > max_work:
+                        result['skipped'] = True
+                    else:
+                        pool = multiprocessing.Pool(1)
+                        try:
+                            seconds, spread, peak_kb = pool.apply(
+                                _run_case, [(name, path, repeat)])
+                        finally:
+                            pool.close()
+                            pool.join()
+                        result.update({'seconds': seconds, 'spread': spread,
+                                       'peak_rss_kb': peak_kb})
+                    results.append(result)
+                    print >> sys.stderr, _format(result)
+    finally:
+        shutil.rmtree(tmpdir)
+    return results
+
+def _format(result):
+    point = '%-16s %7d jobs %5d slots' % (result['case'], result['jobs'],
+                                          result['slots'])
+    if result.get('skipped'):
+        return point + '  skipped'
+    return point + '  %9.4f s  %8d kB' % (result['seconds'],
+                                          result['peak_rss_kb'])
+
+def compare(results, baseline, tolerance=.25, min_seconds=.02):
+    """Find regressions with respect to a baseline.
+
+    A point regresses if its best time exceeds the baseline one by more than
+    tolerance times the baseline, and by more than both min_seconds and the
+    run-to-run spread measured on the point and on the baseline.
+
+    Arguments:
+    results -- list of result dictionaries
+    baseline -- list of result dictionaries of the baseline
+    tolerance -- relative slowdown above which a point regresses
+    min_seconds -- ignore slowdowns smaller than this (timer noise)
+
+    Returns the list of (result, baseline seconds) pairs that regressed.
+
+    """
+    key = lambda r: (r['case'], r['jobs'], r['slots'])
+    reference = dict((key(r), r) for r in baseline if not r.get('skipped'))
+    regressions = []
+    for result in results:
+        ref = reference.get(key(result))
+        if ref is None or result.get('skipped'):
+            continue
+        slowdown = result['seconds'] - ref['seconds']
+        noise = max(min_seconds,
+                    result.get('spread', 0.) + ref.get('spread', 0.))
+        if slowdown > tolerance * ref['seconds'] and slowdown > noise:
+            regressions.append((result, ref['seconds']))
+    return regressions
+
+################################################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Scaling benchmarks of the strategies and scheduler.")
+    parser.add_argument('--cases', nargs='+', default=sorted(CASES),
+                        choices=sorted(CASES))
+    parser.add_argument('--jobs', nargs='+', type=int, default=JOBS)
+    parser.add_argument('--slots', nargs='+', type=int, default=SLOTS)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-work', type=float, default=MAX_WORK)
+    parser.add_argument('--heavy-tailed', action='store_true',
+                        help="one job per pack, heavy-tailed durations and "
+                        "loads")
+    parser.add_argument('--output', default='bench.json',
+                        help="JSON file for the results")
+    parser.add_argument('--baseline', help="JSON file to compare against")
+    parser.add_argument('--tolerance', type=float, default=.25,
+                        help="relative slowdown flagged as a regression")
+    args = parser.parse_args()
+
+    generator = write_heavy_tailed if args.heavy_tailed else write_settings
+    results = run_benchmarks(args.cases, args.jobs, args.slots, args.repeat,
+                             args.max_work, generator)
+    meta = {'python': platform.python_version(), 'numpy': numpy.__version__,
+            'machine': platform.machine(), 'date': time.ctime()}
+    f = open(args.output, 'w')
+    json.dump({'meta': meta, 'results': results}, f, indent=1)
+    f.close()
+
+    if args.baseline:
+        f = open(args.baseline)
+        baseline = json.load(f)['results']
+        f.close()
+        regressions = compare(results, baseline, args.tolerance)
+        for (result, ref_seconds) in regressions:
+            print 'REGRESSION %s (baseline %.4f s)' % (_format(result),
+                                                       ref_seconds)
+        if regressions:
+            sys.exit(1)
+        print 'No regression against', args.baseline
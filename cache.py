@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# cache.py
+# This file is part of DR StratComp.
+#
+# Copyright (C) 2010 - Stéphane Caron
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import errno
+import fcntl
+import hashlib
+import json
+import numpy
+import os
+import sys
+import tempfile
+
+from functools import partial
+from scheduling import Scenario, Settings
+
+"""Content-addressed on-disk cache of simulation results."""
+
+
+def describe(obj):
+    """Canonical description of a sample function or of its arguments.
+
+    Scenarios are described by their content (not their name), arrays by a
+    hash of their content, partial functions by their function and
+    arguments, and functions and classes by their qualified name. Lambdas,
+    closures, bound methods and other callables that cannot be found back
+    from their qualified name raise an exception, since their name does not
+    tell their results apart.
+
+    """
+    if isinstance(obj, Scenario):
+        return 'Scenario(%s)' % obj.fingerprint()
+    if isinstance(obj, partial):
+        return 'partial(%s, %s, %s)' % (describe(obj.func),
+                                        describe(obj.args),
+                                        describe(obj.keywords or {}))
+    if isinstance(obj, numpy.ndarray):
+        data = numpy.ascontiguousarray(obj).tostring()
+        return 'array(%s, %s, %s)' % (obj.dtype.str, obj.shape,
+                                      hashlib.sha1(data).hexdigest())
+    if hasattr(obj, '__module__') and hasattr(obj, '__name__'):
+        module = sys.modules.get(obj.__module__)
+        if getattr(module, obj.__name__, None) is not obj or \
+                getattr(obj, 'func_closure', None) is not None:
+            raise Exception("Cannot describe %r for caching, use a "
+                            "module-level function." % (obj,))
+        return '%s.%s' % (obj.__module__, obj.__name__)
+    if callable(obj):
+        raise Exception("Cannot describe %r for caching, use a module-level "
+                        "function." % (obj,))
+    if isinstance(obj, numpy.generic):
+        return describe(obj.item())
+    if isinstance(obj, float):
+        return repr(obj)
+    if isinstance(obj, (list, tuple)):
+        return '(%s)' % ', '.join(map(describe, obj))
+    if isinstance(obj, dict):
+        items = sorted((describe(k), describe(v)) for (k, v) in obj.items())
+        return '{%s}' % ', '.join('%s: %s' % item for item in items)
+    return repr(obj)
+
+
+class ResultCache:
+
+    """Cache of the samples returned by seeded runs of sample functions.
+
+    Runs are identified by their sample function (including its arguments and
+    scenario), their seed and their keyword arguments, as in the jobs of
+    trials.get_samples. Functions without an explicit scenario argument are
+    identified along with the default scenario (see Settings.use) when they
+    are looked up. All runs of the same function are stored in one JSON
+    entry named after the hash of its description.
+
+    Entries are replaced atomically and updated under a file lock, so that
+    several worker processes can share a cache. When the total size of the
+    entries exceeds max_bytes, least recently used entries are evicted.
+
+    """
+
+    def __init__(self, path='.cache', max_bytes=64 * 2**20):
+        """Open (or create) a cache directory.
+
+        Arguments:
+        path -- cache directory
+        max_bytes -- bound on the total size of cache entries
+
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        try:
+            os.makedirs(path)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def _entry(self, fun):
+        description = describe(fun)
+        if 'Scenario(' not in description:
+            scenario = Settings.scenario
+            description += ' with %s' % (describe(scenario)
+                                         if scenario is not None else None)
+        name = hashlib.sha1(description).hexdigest()
+        return os.path.join(self.path, name + '.json'), description
+
+    def _entries(self, fun, memo):
+        """Get the entry of fun, described once per object in memo."""
+        if id(fun) not in memo:
+            memo[id(fun)] = self._entry(fun)
+        return memo[id(fun)]
+
+    def _read(self, entry_path):
+        try:
+            f = open(entry_path, 'r')
+        except IOError, e:
+            if e.errno == errno.ENOENT:
+                return {}
+            raise
+        try:
+            samples = json.load(f)['samples']
+        finally:
+            f.close()
+        try:
+            os.utime(entry_path, None)
+        except OSError:
+            pass
+        return samples
+
+    def _lock(self, name):
+        """Lock a lock file, created if needed and removed by evict.
+
+        A lock file may be removed between its opening and its locking, in
+        which case the lock is taken again on a new file.
+
+        """
+        lock_path = os.path.join(self.path, name + '.lock')
+        while True:
+            f = open(lock_path, 'a')
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                if os.fstat(f.fileno()).st_ino == os.stat(lock_path).st_ino:
+                    return f
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+            f.close()
+
+    def lookup(self, jobs):
+        """Find the results of (fun, seed, kwargs) jobs in the cache.
+
+        Returns the list of cached results, with None for missing ones.
+
+        """
+        entries, described, results = {}, {}, []
+        for (fun, seed, kwargs) in jobs:
+            entry_path, _ = self._entries(fun, described)
+            if entry_path not in entries:
+                entries[entry_path] = self._read(entry_path)
+            run = describe((int(seed), kwargs))
+            result = entries[entry_path].get(run)
+            if isinstance(result, list):
+                result = numpy.array(result)
+            results.append(result)
+        return results
+
+    def store(self, jobs, results):
+        """Store the results of (fun, seed, kwargs) jobs in the cache."""
+        updates, described = {}, {}
+        for ((fun, seed, kwargs), result) in zip(jobs, results):
+            entry_path, description = self._entries(fun, described)
+            if entry_path not in updates:
+                updates[entry_path] = (description, {})
+            if isinstance(result, numpy.ndarray):
+                result = result.tolist()
+            elif isinstance(result, numpy.generic):
+                result = result.item()
+            updates[entry_path][1][describe((int(seed), kwargs))] = result
+        for (entry_path, (description, samples)) in updates.items():
+            name = os.path.basename(entry_path)[:-len('.json')]
+            lock = self._lock(name)
+            try:
+                merged = self._read(entry_path)
+                merged.update(samples)
+                fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+                f = os.fdopen(fd, 'w')
+                try:
+                    json.dump({'config': description, 'samples': merged}, f)
+                finally:
+                    f.close()
+                os.rename(tmp_path, entry_path)
+            finally:
+                lock.close()
+        self.evict(updates.keys())
+
+    def _remove(self, entry_path):
+        """Remove an entry and its lock file."""
+        lock = self._lock(os.path.basename(entry_path)[:-len('.json')])
+        try:
+            for path in (entry_path, lock.name):
+                try:
+                    os.remove(path)
+                except OSError, e:
+                    if e.errno != errno.ENOENT:
+                        raise
+        finally:
+            lock.close()
+
+    def evict(self, keep=()):
+        """Remove least recently used entries until the cache fits.
+
+        Arguments:
+        keep -- paths of entries not to remove, e.g. those just stored, even
+            if they do not fit on their own
+
+        """
+        lock = self._lock('evict')
+        try:
+            entries = []
+            for name in os.listdir(self.path):
+                if name.endswith('.json'):
+                    entry_path = os.path.join(self.path, name)
+                    try:
+                        st = os.stat(entry_path)
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, entry_path))
+            total = sum(size for (_, size, _) in entries)
+            for (mtime, size, entry_path) in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if entry_path not in keep:
+                    self._remove(entry_path)
+                    total -= size
+        finally:
+            lock.close()
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        for name in os.listdir(self.path):
+            if name.endswith('.json'):
+                self._remove(os.path.join(self.path, name))
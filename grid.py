@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# grid.py
+# This file is part of DR StratComp.
+#
+# Copyright (C) 2010 - Stéphane Caron
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import multiprocessing
+import numpy
+import os
+import random
+import time
+
+from scheduling import Scenario, gc_from_loads, par_from_loads
+from trials import replica_seeds
+import scenarios
+
+"""Hierarchical scenarios: feeders below a substation.
+
+Each feeder is a scenario of its own, with its capacity L, tariff and jobs,
+and schedules them with any strategy of the strats modules, independently of
+the other feeders. Feeder load profiles add up at the substation, which has
+its own capacity and tariff. A grid file lists feeders below a substation
+header in the format of the settings/ directory:
+
+    L = 9000 kW
+    nb_slots = 36 slots
+    C0 = 2.8e-6 $/kW/s
+    C1 = 2.8e-8 $/kW^2/s
+
+    2
+    3 residential.in
+    1 heterogeneous.in
+
+where each line gives a number of feeders and their scenario file, relative
+to the directory of the grid file (text or binary, see scenarios.py).
+
+Feeders are scheduled in parallel by a pool of worker processes, which
+receive the scenarios once. With coordination rounds, the substation then
+sends down to each feeder the deviation of the substation load from its
+average, scaled to the capacity of the feeder, which the feeder adds to its
+load profile before scheduling again. Strategies that look at the load (all
+but uniform.Scheduler, which ignores it) thus move jobs from the slots where
+the substation is above average to the others. Moving all feeders at once
+may overshoot, so the substation only lets a feeder adopt its new schedule
+if it lowers the substation GC (see accept_plans), which therefore never
+increases over rounds.
+
+"""
+
+
+class Grid:
+
+    """Substation and the feeders below it."""
+
+    def __init__(self, substation, feeders, names=None):
+        """Constructor for a grid.
+
+        Arguments:
+        substation -- Scenario instance without packs, giving the capacity and
+            tariff of the substation
+        feeders -- list of Scenario instances, one per feeder
+        names -- names of the feeders (defaults to the scenario names)
+
+        """
+        for feeder in feeders:
+            if feeder.nb_slots != substation.nb_slots or \
+                    feeder.T != substation.T:
+                raise Exception("Feeder %s does not share the time slots of "
+                                "the substation." % feeder.name)
+        self.substation = substation
+        self.feeders = list(feeders)
+        self.names = names or [feeder.name for feeder in feeders]
+
+    @classmethod
+    def from_file(cls, path):
+        """Read a grid file (see the module documentation)."""
+        f = open(path, 'r')
+        try:
+            L = float(f.readline().split()[2])
+            nb_slots = int(f.readline().split()[2])
+            C0 = float(f.readline().split()[2])
+            C1 = float(f.readline().split()[2])
+            f.readline() # skip blank line
+            nb_lines = int(f.readline().split()[0])
+            lines = [f.readline().split() for i in range(nb_lines)]
+        finally:
+            f.close()
+        substation = Scenario(L, nb_slots, C0, C1, [],
+                              name=os.path.basename(path))
+        directory = os.path.dirname(path)
+        feeders, names = [], []
+        for (num, file) in lines:
+            feeder = scenarios.load(os.path.join(directory, file))
+            for k in range(int(num)):
+                feeders.append(feeder)
+                names.append('%s#%d' % (file, k) if int(num) > 1 else file)
+        return cls(substation, feeders, names)
+
+################################################################################
+
+# Feeders and scheduler factory of the current worker process, set once by
+# _init_worker so that scenarios are not pickled with every task.
+
+_worker = {}
+
+def _init_worker(feeders, make_sched):
+    _worker['feeders'] = feeders
+    _worker['make_sched'] = make_sched
+
+def _schedule_feeder(job):
+    """Schedule the jobs of a feeder in the current worker process.
+
+    Returns the load profile of the feeder, background excluded, and the
+    time spent.
+
+    """
+    index, seed, background = job
+    random.seed(seed)
+    numpy.random.seed(seed)
+    start = time.time()
+    sched = _worker['make_sched'](_worker['feeders'][index])
+    if background is not None:
+        sched.load_profile.inst_load += background
+    sched.schedule_tasks()
+    load = sched.load_profile.inst_load
+    if background is not None:
+        load = load - background
+    return load, time.time() - start
+
+def substation_signal(total, feeder, substation):
+    """Background load sent down to a feeder by the substation.
+
+    The signal is the deviation of the substation load from its average,
+    scaled by the ratio of the feeder capacity to the substation one, so that
+    it does not change the average load seen by the feeder.
+
+    Arguments:
+    total -- load profile of the substation
+    feeder -- Scenario instance of the feeder
+    substation -- Scenario instance of the substation
+
+    """
+    return feeder.L / substation.L * (total - total.mean())
+
+def accept_plans(loads, plans, substation):
+    """Let feeders adopt their new load profiles if it lowers substation GC.
+
+    Feeders are considered by decreasing GC decrease of their new profile
+    alone, and each adopts it if it lowers the GC given the profiles adopted
+    before.
+
+    Arguments:
+    loads -- (nb_feeders, nb_slots) array of current feeder load profiles
+    plans -- (nb_feeders, nb_slots) array of new feeder load profiles
+    substation -- Scenario instance of the substation
+
+    Returns the new array of feeder load profiles and the list of indices of
+    the feeders that adopted their new profile.
+
+    """
+    total = loads.sum(axis=0)
+    gc = gc_from_loads(total, substation)
+    gains = gc - gc_from_loads(total - loads + plans, substation)
+    loads = loads.copy()
+    moved = []
+    for k in numpy.argsort(-gains):
+        if gains[k] <= 0.:
+            break
+        new_total = total - loads[k] + plans[k]
+        new_gc = gc_from_loads(new_total, substation)
+        if new_gc < gc:
+            loads[k], total, gc = plans[k], new_total, new_gc
+            moved.append(k)
+    return loads, sorted(moved)
+
+def simulate(grid, make_sched, rounds=0, seed=None, processes=None):
+    """Schedule every feeder of a grid and aggregate their loads.
+
+    Feeder k seeds the random and numpy.random streams with the k-th seed
+    derived from the master seed, in every round, so that results do not
+    depend on the number of processes and rounds only differ by the signal
+    sent down by the substation (see substation_signal). Rounds stop early
+    when no feeder adopts its new schedule, since the next round would then
+    be the same.
+
+    Arguments:
+    grid -- Grid instance
+    make_sched -- function returning a new Scheduler instance for a feeder
+        scenario, picklable if processes != 1 (e.g.
+        functools.partial(aloha.Scheduler, .2, 0))
+    rounds -- maximum number of coordination rounds after the independent
+        one
+    seed -- master seed (drawn at random if None)
+    processes -- number of worker processes (None: one per CPU)
+
+    Returns a dictionary with the final (nb_feeders, nb_slots) array of
+    feeder loads ('loads'), the substation load ('total'), the GC of each
+    feeder under its own tariff ('feeder_gc'), the GC and PAR of the
+    substation ('substation_gc', 'substation_par'), the substation GC after
+    every round played ('trace'), the number of feeders that adopted a new
+    schedule in each coordination round ('moves') and the wall-clock and
+    summed worker times ('seconds', 'cpu_seconds').
+
+    """
+    if seed is None:
+        seed = numpy.random.randint(2**31 - 1)
+    feeders, substation = grid.feeders, grid.substation
+    seeds = replica_seeds(len(feeders), seed)
+    if processes == 1:
+        pool = None
+        _init_worker(feeders, make_sched)
+    else:
+        pool = multiprocessing.Pool(processes, _init_worker,
+                                    (feeders, make_sched))
+    start = time.time()
+    cpu_seconds = 0.
+    background = [None] * len(feeders)
+    loads = None
+    trace, moves = [], []
+    try:
+        for r in range(rounds + 1):
+            jobs = zip(range(len(feeders)), seeds, background)
+            if pool is None:
+                results = map(_schedule_feeder, jobs)
+            else:
+                results = pool.map(_schedule_feeder, jobs, chunksize=1)
+            plans = numpy.array([load for (load, _) in results])
+            cpu_seconds += sum(seconds for (_, seconds) in results)
+            if loads is None:
+                loads = plans
+            else:
+                loads, moved = accept_plans(loads, plans, substation)
+                moves.append(len(moved))
+                if not moved:
+                    break
+            total = loads.sum(axis=0)
+            trace.append(float(gc_from_loads(total, substation)))
+            background = [substation_signal(total, feeder, substation)
+                          for feeder in feeders]
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    total = loads.sum(axis=0)
+    return {'loads': loads, 'total': total,
+            'feeder_gc': [float(gc_from_loads(load, feeder))
+                          for (load, feeder) in zip(loads, feeders)],
+            'substation_gc': trace[-1],
+            'substation_par': float(par_from_loads(total)),
+            'trace': trace, 'moves': moves, 'seconds': time.time() - start,
+            'cpu_seconds': cpu_seconds}
+
+################################################################################
+
+if __name__ == "__main__":
+    import argparse
+    from functools import partial
+    from strats import aloha, game, timeslack, uniform
+    strategies = {
+        'uniform': uniform.Scheduler,
+        'aloha': partial(aloha.Scheduler, .2, 0),
+        'timeslack': partial(timeslack.Scheduler, .06),
+        'game': partial(game.Scheduler, 2)}
+    parser = argparse.ArgumentParser(
+        description="Schedule the feeders of a grid in parallel.")
+    parser.add_argument('grid', help="grid file")
+    parser.add_argument('--strategy', default='game',
+                        choices=sorted(strategies))
+    parser.add_argument('--rounds', type=int, default=0,
+                        help="coordination rounds")
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--processes', type=int, default=0,
+                        help="worker processes (0: one per CPU)")
+    args = parser.parse_args()
+    grid = Grid.from_file(args.grid)
+    result = simulate(grid, strategies[args.strategy], args.rounds,
+                      args.seed, args.processes or None)
+    for (name, gc) in zip(grid.names, result['feeder_gc']):
+        print '%-24s GC %12.4f' % (name, gc)
+    print 'Substation GC over rounds:', ' '.join(
+        '%.4f' % gc for gc in result['trace'])
+    if args.rounds:
+        print 'Feeders moved per round:', ' '.join(map(str, result['moves']))
+    print 'Substation PAR %.4f, %d feeders in %.2f s (%.2f s of work)' % (
+        result['substation_par'], len(grid.feeders), result['seconds'],
+        result['cpu_seconds'])
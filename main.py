@@ -20,13 +20,20 @@
 # this program. If not, see <http://www.gnu.org/licenses/>.
 #
 
-import matplotlib.pyplot as plt
+import csv
+import json
 import numpy
+import random
+import sys
 import time
 
+from functools import partial
+
 from scheduling import Settings
 from strats import aloha, game, timeslack, uniform
+import optimum
 import scheduling
+import thresholds
 import trials
 
 
@@ -42,34 +49,125 @@ _ALOHA_2_OVER = .0175
 _TIME_SLACKNESS = .06
 
 
-def compute_moments():
-    """Compute first moments (mean and standard deviation) for several runs of
-    all the policies available in the strats module.
+def moments_table(seed=None, processes=None, rel_width=.02, cache=None,
+                  reduce=False, exact=False):
+    """Estimate the mean GC of all the policies available in the strats
+    module.
+
+    Each policy is run until the 95% confidence interval on its mean GC is
+    tighter than rel_width (relative), within a budget of replicas.
+
+    Arguments:
+    seed -- master seed of the runs (random if None)
+    processes -- number of worker processes (None: one per CPU)
+    rel_width -- target relative half-width of the confidence intervals
+    cache -- cache.ResultCache reused across calls with the same seed
+    reduce -- estimate the GC of the Uniform policy from antithetic pairs
+        with control variates (see trials.reduce_variance), which needs far
+        fewer runs
+    exact -- compute the expected GC of the Uniform policy without
+        simulation (see strats.uniform.expected_gc); its 'std' and 'ess' are
+        then None
+
+    Returns a list of rows, one per policy, each row being a dictionary with
+    keys 'strategy', 'mean', 'std', 'half_width', 'count' and 'ess' (see
+    trials.Moments). With reduce, the 'std' of Uniform is that of the reduced
+    samples.
 
     """
-    game_mmts = trials.get_first_moments(5, game.sample_gc)
-    aloha1_mmts = trials.get_first_moments(200, lambda:
-        aloha.sample_gc(_ALOHA_1, 0))
-    aloha2_mmts = trials.get_first_moments(200, lambda:
-        aloha.sample_gc(_ALOHA_2_SAFE, _ALOHA_2_OVER))
-    alpha = _TIME_SLACKNESS
-    timeslack_mmts = trials.get_first_moments(200, lambda:
-        timeslack.sample_gc(alpha))
-    uni_mmts = trials.get_first_moments(200, uniform.sample_gc)
-    moments = [game_mmts, timeslack_mmts, aloha2_mmts, aloha1_mmts, uni_mmts]
+    scenario = Settings.get_scenario()
+    run = lambda fun, max_iter, batch=False, **kwargs: \
+        trials.get_adaptive_moments(partial(fun, scenario=scenario),
+                                    rel_width, batch, max_iter=max_iter,
+                                    seed=seed, processes=processes,
+                                    cache=cache, **kwargs)
+    game_acc = run(game.sample_gc, 100)
+    aloha1_acc = run(partial(aloha.sample_gc, _ALOHA_1, 0), 2000, batch=True)
+    aloha2_acc = run(partial(aloha.sample_gc, _ALOHA_2_SAFE, _ALOHA_2_OVER),
+                     2000, batch=True)
+    timeslack_acc = run(partial(timeslack.sample_gc, _TIME_SLACKNESS), 2000,
+                        batch=True)
+    accs = [game_acc, timeslack_acc, aloha2_acc, aloha1_acc]
     labels = ['Game', 'Time/Slackness', 'ALOHA-like II', 'ALOHA-like I',
               'Uniform']
-    means = map(lambda m: m[0], moments)
-    devs = map(lambda m: m[1], moments)
+    if reduce and not exact:
+        accs.append(run(partial(uniform.sample_gc_controls, antithetic=True),
+                        2000, batch=True,
+                        means=uniform.control_means(scenario),
+                        antithetic=True))
+    elif not exact:
+        accs.append(run(uniform.sample_gc, 2000, batch=True))
+    rows = [{'strategy': label, 'mean': acc.mean, 'std': acc.std(),
+             'half_width': acc.half_width(), 'count': acc.count,
+             'ess': acc.ess} for (label, acc) in zip(labels, accs)]
+    if exact:
+        rows.append({'strategy': 'Uniform', 'count': 0, 'std': None,
+                     'mean': uniform.expected_gc(scenario), 'half_width': 0.,
+                     'ess': None})
+    return rows
+
+def compute_moments(seed=None, processes=None, rel_width=.02, cache=None):
+    """Compute first moments (mean and standard deviation) for several runs of
+    all the policies available in the strats module.
+
+    Arguments are those of moments_table.
+
+    """
+    rows = moments_table(seed, processes, rel_width, cache)
+    means = [row['mean'] for row in rows]
+    devs = [row['std'] for row in rows]
+    labels = [row['strategy'] for row in rows]
     return means, devs, labels
 
+def compare_policies(niter, seed=None, processes=None, cache=None):
+    """Compare the GC of the batched policies to that of the Uniform policy
+    on common random numbers (see trials.get_paired_moments).
+
+    Arguments:
+    niter -- number of runs per policy
+    seed -- master seed of the runs (random if None)
+    processes -- number of worker processes (None: one per CPU)
+    cache -- cache.ResultCache reused across calls with the same seed
+
+    Returns the table of trials.get_paired_moments, with a 'strategy' key.
+
+    """
+    scenario = Settings.get_scenario()
+    series = [('Uniform', uniform.sample_gc),
+              ('ALOHA-like I', partial(aloha.sample_gc, _ALOHA_1, 0)),
+              ('ALOHA-like II', partial(aloha.sample_gc, _ALOHA_2_SAFE,
+                                        _ALOHA_2_OVER)),
+              ('Time/Slackness', partial(timeslack.sample_gc,
+                                         _TIME_SLACKNESS))]
+    table = trials.get_paired_moments(
+        [partial(fun, scenario=scenario) for (_, fun) in series], niter,
+        True, seed, processes, cache)
+    for ((label, _), row) in zip(series, table):
+        row['strategy'] = label
+    return table
+
 ################################################################################
 
-def plot_gc(means, devs, labels):
-    """Plot the GCs (with error bars) for the different policies."""
+def plot_gc(means, devs, labels, bound=None):
+    """Plot the GCs (with error bars) for the different policies.
+
+    Arguments:
+    means -- list of average GCs
+    devs -- list of standard deviations
+    labels -- list of policy names
+    bound -- lower bound on GC (see optimum.relaxation), shown as an extra
+        bar if not None
+
+    """
+    import matplotlib.pyplot as plt
+    colors = [(0, .6, .9)] * len(labels)
+    if bound is not None:
+        means, devs = list(means) + [bound], list(devs) + [0.]
+        labels = list(labels) + ['Lower bound']
+        colors.append((.5, .5, .5))
     yalign = numpy.arange(len(labels))+.5
     plt.barh(yalign, means, xerr=devs, ecolor='r', align='center',
-             color=(0, .6, .9), capsize=15)
+             color=colors, capsize=15)
     plt.yticks(yalign, ('', '', '', ''))
     for i, ylabel in enumerate(labels):
         plt.text(0, .5 + i, '  ' + ylabel, ha='left', va='center',
@@ -81,26 +179,29 @@ def plot_gc(means, devs, labels):
 
 def plot_load_profile(sched, title):
     """Plot the load profile of a run of a given Scheduler instance."""
+    import matplotlib.pyplot as plt
     sched.schedule_tasks()
     sched.load_profile.plot()
-    plt.axhline(y=Settings.L, xmin=0, xmax=1, color='r')
-    plt.ylim(ymin=0, ymax=2*Settings.L)
+    plt.axhline(y=sched.scenario.L, xmin=0, xmax=1, color='r')
+    plt.ylim(ymin=0, ymax=2*sched.scenario.L)
     plt.title(title)
 
 ################################################################################
 
 def example_plot_gc_only():
     """Plot GC for the different policies."""
+    import matplotlib.pyplot as plt
     means, devs, labels = compute_moments()
     plt.subplot(111)
-    plot_gc(means, devs, labels)
+    plot_gc(means, devs, labels, optimum.relaxation()[0])
     plt.show()
 
 def example_plot_load_profiles():
     """Plot GC and a sample load profile for each policy."""
+    import matplotlib.pyplot as plt
     means, devs, labels = compute_moments()
     plt.subplot(321)
-    plot_gc(means, devs, labels)
+    plot_gc(means, devs, labels, optimum.relaxation()[0])
     plt.subplot(322)
     plot_load_profile(uniform.Scheduler(),
                       'Uniform Sample')
@@ -118,27 +219,45 @@ def example_plot_load_profiles():
                       'Game Sample')
     plt.show()
 
-def example_average_par():
+def compute_average_par(seed=None, processes=None, cache=None):
+    """Compute first moments (mean and standard deviation) of the PAR of all
+    the policies available in the strats module.
+
+    Arguments:
+    seed -- master seed of the runs (random if None)
+    processes -- number of worker processes (None: one per CPU)
+    cache -- cache.ResultCache reused across calls with the same seed
+
+    """
+    scenario = Settings.get_scenario()
+    run = lambda niter, fun, batch=False: trials.get_first_moments(
+        niter, partial(fun, scenario=scenario), batch, seed, processes,
+        cache)
+    game_mmts = run(5, game.sample_par)
+    timeslack_mmts = run(100, partial(timeslack.sample_par, _TIME_SLACKNESS),
+                         batch=True)
+    aloha2_mmts = run(100, partial(aloha.sample_par, _ALOHA_2_SAFE,
+                                   _ALOHA_2_OVER), batch=True)
+    aloha1_mmts = run(100, partial(aloha.sample_par, _ALOHA_1, 0),
+                      batch=True)
+    uni_mmts = run(100, uniform.sample_par, batch=True)
+    moments = [game_mmts, timeslack_mmts, aloha2_mmts, aloha1_mmts, uni_mmts]
+    labels = ['Game', 'Time/Slackness', 'ALOHA-like II', 'ALOHA-like I',
+              'Uniform']
+    means = map(lambda m: m[0], moments)
+    devs = map(lambda m: m[1], moments)
+    return means, devs, labels
+
+def example_average_par(seed=None, processes=None, cache=None):
     """Compare the average PAR of each policy."""
-    uniform_par_mmts = trials.get_first_moments(100,
-        uniform.sample_par)
-    aloha1_par_mmts = trials.get_first_moments(100, lambda:
-        aloha.sample_gc(_ALOHA_1, 0))
-    aloha2_par_mmts = trials.get_first_moments(100, lambda:
-        aloha.sample_gc(_ALOHA_2_SAFE, _ALOHA_2_OVER))
-    timeslack_par_mmts = trials.get_first_moments(100, lambda:
-        timeslack.sample_gc(_TIME_SLACKNESS))
-    game_par_mmts = trials.get_first_moments(5,
-        game.sample_par)
+    means, devs, labels = compute_average_par(seed, processes, cache)
     print 'Average PAR (mean, std. dev.)'
-    print ' - Uniform:', uniform_par_mmts
-    print ' - ALOHA-like I:', aloha1_par_mmts
-    print ' - ALOHA-like II:', aloha1_par_mmts
-    print ' - Time/Slackness:', aloha1_par_mmts
-    print ' - Game:', game_par_mmts
+    for (label, mean, dev) in reversed(zip(labels, means, devs)):
+        print ' - %s:' % label, (mean, dev)
 
 def example_uniform_vs_game():
     """Plot a Uniform and a Game load profile."""
+    import matplotlib.pyplot as plt
     plt.subplot(211)
     plot_load_profile(uniform.Scheduler(),
                       'Uniform Load Profile')
@@ -149,9 +268,192 @@ def example_uniform_vs_game():
 
 ################################################################################
 
+def sample_load_profiles(seed=None):
+    """Schedule all the tasks once with each policy.
+
+    Arguments:
+    seed -- seed of the runs (random if None)
+
+    Returns the list of (label, array of instant loads) pairs.
+
+    """
+    if seed is not None:
+        random.seed(seed)
+        numpy.random.seed(seed)
+    scheds = [('Game', game.Scheduler(2)),
+              ('Time/Slackness', timeslack.Scheduler(_TIME_SLACKNESS)),
+              ('ALOHA-like II', aloha.Scheduler(_ALOHA_2_SAFE,
+                                                _ALOHA_2_OVER)),
+              ('ALOHA-like I', aloha.Scheduler(_ALOHA_1, 0)),
+              ('Uniform', uniform.Scheduler())]
+    profiles = []
+    for (label, sched) in scheds:
+        sched.schedule_tasks()
+        profiles.append((label, sched.load_profile.inst_load.copy()))
+    return profiles
+
+def write_rows(rows, fields, path=None, meta=None):
+    """Write a table of results in CSV or JSON.
+
+    Arguments:
+    rows -- list of dictionaries
+    fields -- keys of the rows, in column order
+    path -- output file, in JSON if its name ends with .json and in CSV
+        otherwise (standard output if None)
+    meta -- dictionary describing the experiment, written in JSON only
+
+    """
+    f = sys.stdout if path is None else open(path, 'w')
+    try:
+        if path is not None and path.endswith('.json'):
+            json.dump({'meta': meta or {}, 'rows': rows}, f, indent=1,
+                      sort_keys=True)
+            f.write('\n')
+        else:
+            writer = csv.DictWriter(f, fields, extrasaction='ignore')
+            writer.writerow(dict(zip(fields, fields)))
+            writer.writerows(rows)
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+def plot_rows(experiment, rows, xvals=None):
+    """Plot the table of results of a command-line experiment.
+
+    Arguments:
+    experiment -- 'moments', 'par', 'compare', 'sweep' or 'profile'
+    rows -- table of results (see the __main__ block)
+    xvals -- domain of the parameters of a sweep
+
+    """
+    import matplotlib.pyplot as plt
+    if experiment in ['moments', 'par', 'compare']:
+        bounds = [row['mean'] for row in rows
+                  if row['strategy'] == 'Lower bound']
+        rows = [row for row in rows if row['strategy'] != 'Lower bound']
+        plot_gc([row['mean'] for row in rows],
+                [row['std'] or 0. for row in rows],
+                [row['strategy'] for row in rows],
+                bounds[0] if bounds else None)
+        if experiment == 'par':
+            plt.xlabel('PAR')
+    elif experiment == 'sweep':
+        thresholds.plot_sweep(xvals, rows)
+    else:
+        labels = []
+        for row in rows:
+            if row['strategy'] not in labels:
+                labels.append(row['strategy'])
+        for label in labels:
+            loads = [row['load'] for row in rows if row['strategy'] == label]
+            plt.step(range(len(loads)), loads, where='post', label=label)
+        plt.axhline(y=Settings.L, xmin=0, xmax=1, color='r')
+        plt.xlabel('Time slot')
+        plt.ylabel('Load (kW)')
+        plt.title(Settings.file)
+        plt.legend(loc='upper right')
+        plt.grid(True)
+
+################################################################################
+
 if __name__ == "__main__":
-    Settings.from_file('heterogeneous.in')
-    #example_plot_load_profiles()
-    example_plot_gc_only()
-    #example_average_par()
-    #example_uniform_vs_game()
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Run an experiment without display and write its results "
+        "in CSV (or JSON if the output ends with .json).")
+    parser.add_argument('experiment', nargs='?', default='moments',
+                        choices=['moments', 'par', 'compare', 'sweep',
+                                 'profile'],
+                        help="GC moments, PAR moments, paired comparison of "
+                        "GCs, parameter sweep or sample load profiles of the "
+                        "policies")
+    parser.add_argument('--config', help="JSON file of default values for "
+                        "the options below, e.g. {\"settings\": "
+                        "\"residential.in\"}")
+    parser.add_argument('--settings', default='heterogeneous.in',
+                        help="scenario file in the settings/ directory")
+    parser.add_argument('--seed', type=int, help="master seed (drawn at "
+                        "random and recorded if not given)")
+    parser.add_argument('--processes', type=int, default=1,
+                        help="number of worker processes (0: one per CPU)")
+    parser.add_argument('--cache', help="directory of a cache of results")
+    parser.add_argument('--rel-width', type=float, default=.02,
+                        help="target relative half-width of the confidence "
+                        "intervals of moments")
+    parser.add_argument('--reduce', action='store_true',
+                        help="reduce the variance of the Uniform GC in "
+                        "moments with antithetic runs and control variates")
+    parser.add_argument('--exact', action='store_true',
+                        help="compute the expected GC of Uniform in moments "
+                        "without simulation")
+    parser.add_argument('--bound', action='store_true',
+                        help="add the lower bound on GC to moments")
+    parser.add_argument('--xvals', nargs=3, type=float,
+                        default=[0., 1.025, .025], metavar=('START', 'STOP',
+                                                            'STEP'),
+                        help="parameter domain of sweeps")
+    parser.add_argument('--niter', type=int, help="runs per policy in "
+                        "comparisons (default: 1000) and per point of every "
+                        "policy in sweeps (default: thresholds.NITERS)")
+    parser.add_argument('--output', help="output file (default: standard "
+                        "output, in CSV)")
+    parser.add_argument('--plot', help="also plot results to this image file")
+    args, _ = parser.parse_known_args()
+    if args.config:
+        f = open(args.config)
+        config = json.load(f)
+        f.close()
+        parser.set_defaults(**dict((str(key).replace('-', '_'), value)
+                                   for (key, value) in config.items()))
+    args = parser.parse_args()
+
+    if args.plot:
+        import matplotlib
+        matplotlib.use('Agg')
+    if args.seed is None:
+        args.seed = numpy.random.randint(2**31 - 1)
+    processes = args.processes or None
+    results_cache = None
+    if args.cache:
+        import cache
+        results_cache = cache.ResultCache(args.cache)
+    Settings.from_file(args.settings)
+    xvals = numpy.arange(*args.xvals)
+    start = time.time()
+    if args.experiment == 'moments':
+        rows = moments_table(args.seed, processes, args.rel_width,
+                             results_cache, args.reduce, args.exact)
+        if args.bound:
+            rows.append({'strategy': 'Lower bound', 'mean':
+                         optimum.relaxation()[0], 'std': 0.})
+        fields = ['strategy', 'mean', 'std', 'half_width', 'count', 'ess']
+    elif args.experiment == 'par':
+        means, devs, labels = compute_average_par(args.seed, processes,
+                                                  results_cache)
+        rows = [{'strategy': label, 'mean': mean, 'std': dev}
+                for (label, mean, dev) in zip(labels, means, devs)]
+        fields = ['strategy', 'mean', 'std']
+    elif args.experiment == 'compare':
+        rows = compare_policies(args.niter or 1000, args.seed, processes,
+                                results_cache)
+        fields = ['strategy', 'mean', 'std', 'count', 'diff',
+                  'diff_half_width', 'ess']
+    elif args.experiment == 'sweep':
+        niters = thresholds.NITERS if args.niter is None else \
+            dict((label, args.niter) for label in thresholds.NITERS)
+        rows = thresholds.sweep_table(xvals, niters, args.seed, processes,
+                                      results_cache)
+        fields = ['strategy', 'param', 'mean', 'std', 'count']
+    else:
+        rows = [{'strategy': label, 'slot': slot, 'load': float(load)}
+                for (label, loads) in sample_load_profiles(args.seed)
+                for (slot, load) in enumerate(loads)]
+        fields = ['strategy', 'slot', 'load']
+    meta = {'experiment': args.experiment, 'settings': args.settings,
+            'seed': args.seed, 'seconds': time.time() - start,
+            'date': time.ctime()}
+    write_rows(rows, fields, args.output, meta)
+    if args.plot:
+        import matplotlib.pyplot as plt
+        plot_rows(args.experiment, rows, xvals)
+        plt.savefig(args.plot)
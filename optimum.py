@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# optimum.py
+# This file is part of DR StratComp.
+#
+# Copyright (C) 2010 - Stéphane Caron
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import numpy
+import time
+
+from scheduling import Settings
+from strats import game
+import scheduling
+
+"""Lower bound on the Global Cost of any schedule.
+
+All jobs of a pack are identical, so a schedule is described by the number of
+jobs of each pack starting at each time slot, and GC only depends on the load
+profile. Since dt * (C0 + C1 * max(l - L, 0)) * l is convex in the instant
+load l, relaxing these counts to non-negative reals yields a convex problem
+over a product of simplices (one per pack), whose optimum is below the GC of
+any schedule.
+
+The relaxation is solved by pairwise Frank-Wolfe steps, pack after pack. The
+linear minimization over a pack is a best response of the congestion game: put
+the whole pack on the window of least marginal cost. By convexity, the
+objective minus the Frank-Wolfe gap at any feasible point is a valid lower
+bound, so the bound is certified whenever the solver stops.
+
+"""
+
+
+# A smoothing stage stalls when its last _PATIENCE passes closed less than
+# this fraction of the gap between the relaxed GC and the lower bound.
+
+_PATIENCE = 50
+_STALL = .1
+
+
+def _window_sums(values, tau):
+    cumsum = numpy.concatenate(([0.], numpy.cumsum(values)))
+    return cumsum[tau:] - cumsum[:-tau]
+
+def _overage(load, L, delta):
+    """Smoothed overage cost sum_u h(l_u), where h(l) = max(l - L, 0) * l.
+
+    The derivative of h jumps by L at l = L. Below L + delta, it is replaced
+    by a linear ramp, which makes the smoothed h a convex minorant of h with a
+    Lipschitz derivative, at most delta * L / 2 below h.
+
+    Returns the smoothed cost and its gradient.
+
+    """
+    over = load - L
+    ramp = (L + 2 * delta) / delta
+    cost = numpy.where(over >= delta, over * load - delta * L / 2,
+                       numpy.where(over > 0., ramp * over ** 2 / 2, 0.))
+    grad = numpy.where(over >= delta, 2 * load - L,
+                       numpy.where(over > 0., ramp * over, 0.))
+    return cost.sum(), grad
+
+def _line_search(load, step_dir, step_max, L, delta):
+    """Minimize the smoothed overage cost along load + step * step_dir.
+
+    The cost is convex with a piecewise linear derivative, so Newton steps
+    converge in a few iterations. They are safeguarded by bisection whenever
+    they do not halve the bracket of the minimum.
+
+    """
+    deriv = lambda step: _overage(load + step * step_dir, L,
+                                  delta)[1].dot(step_dir)
+    lo, hi = 0., step_max
+    if deriv(hi) <= 0.:
+        return hi
+    step = hi / 2
+    ramp = (L + 2 * delta) / delta
+    for i in range(100):
+        width = hi - lo
+        dphi = deriv(step)
+        if dphi > 0.:
+            hi = step
+        else:
+            lo = step
+        if hi - lo <= 1e-12 * step_max:
+            break
+        over = load + step * step_dir - L
+        curv = (numpy.where(over >= delta, 2., numpy.where(over > 0., ramp,
+                                                           0.))
+                * step_dir ** 2).sum()
+        newton = step - dphi / curv if curv > 0. else -1.
+        if lo < newton < hi and hi - lo < width / 2:
+            step = newton
+        else:
+            step = (lo + hi) / 2
+    return lo
+
+def relaxation(scenario=None, rel_gap=1e-4, max_iter=10000,
+               max_time=10.):
+    """Solve the continuous relaxation of the minimum GC problem.
+
+    The kink of the utility cost at L makes plain Frank-Wolfe stall, so the
+    overage cost is smoothed from below (see _overage) with a smoothing width
+    that shrinks by stages. Each stage yields a valid lower bound, since the
+    smoothed GC is below the true one. A stage ends when its Frank-Wolfe gap
+    falls below the smoothing error, since the bound cannot get closer at
+    this width, or when the bound stalls (see _STALL). The solver stops when
+    the bound stalls with a negligible smoothing error.
+
+    Arguments:
+    scenario -- Scenario instance (defaults to Settings.get_scenario())
+    rel_gap -- stop when the relaxed GC and the lower bound are this close
+    max_iter -- maximum number of passes over packs
+    max_time -- stop after this many seconds (None: no limit)
+
+    Returns the lower bound on GC and the list, for each pack, of the array of
+    fractions of its jobs starting at each time slot.
+
+    """
+    scenario = scenario or Settings.get_scenario()
+    S, L = scenario.nb_slots, scenario.L
+    dt = scenario.T / S
+    packs = [pack for pack in scenario.packs if pack.num > 0]
+    masses = [pack.num * pack.inst_cost for pack in packs]
+    fracs = [numpy.ones(S - pack.nb_slots + 1) / (S - pack.nb_slots + 1)
+             for pack in packs]
+    load = numpy.zeros(S)
+    for (pack, mass, frac) in zip(packs, masses, fracs):
+        load += mass * numpy.convolve(frac, numpy.ones(pack.nb_slots))
+    work = dt * scenario.C0 * load.sum()
+    total = load.sum()
+    lower = work + dt * scenario.C1 * S * max(total / S - L, 0.) * total / S
+    delta = max(L, total / S)
+    start = time.time()
+    history = []
+    for i in range(max_iter):
+        gc = scheduling.gc_from_loads(load, scenario)
+        if gc - lower <= rel_gap * gc:
+            break
+        if max_time is not None and time.time() - start > max_time:
+            break
+        cost, grad = _overage(load, L, delta)
+        gap = 0.
+        for (pack, mass, frac) in zip(packs, masses, fracs):
+            costs = mass * _window_sums(grad, pack.nb_slots)
+            gap += costs.dot(frac) - costs.min()
+        lower = max(lower, work + dt * scenario.C1 * (cost - gap))
+        history.append(lower)
+        over = numpy.maximum(load - L, 0.)
+        bias = (over * load).sum() - cost
+        stalled = len(history) > _PATIENCE and \
+            lower - history[-_PATIENCE - 1] < _STALL * (gc - lower)
+        if stalled and bias <= rel_gap * cost / 2:
+            break
+        if stalled or gap <= max(rel_gap * cost / 2, bias):
+            delta /= 4
+            history = []
+        for (pack, mass, frac) in zip(packs, masses, fracs):
+            tau = pack.nb_slots
+            costs = _window_sums(_overage(load, L, delta)[1], tau)
+            fw = costs.argmin()
+            support = numpy.flatnonzero(frac > 0.)
+            away = support[costs[support].argmax()]
+            if costs[away] <= costs[fw]:
+                continue
+            step_dir = numpy.zeros(S)
+            step_dir[fw:fw + tau] += mass
+            step_dir[away:away + tau] -= mass
+            lo, hi = min(fw, away), max(fw, away) + tau
+            step = _line_search(load[lo:hi], step_dir[lo:hi], frac[away], L,
+                                delta)
+            load += step * step_dir
+            frac[fw] += step
+            frac[away] = 0. if step == frac[away] else frac[away] - step
+    return lower, fracs
+
+def rounded_counts(scenario, fracs):
+    """Round fractions of jobs to integer counts per start slot.
+
+    Cumulated fractions are rounded, so that counts sum to the pack size and
+    follow the fractional schedule as closely as possible over time.
+
+    Returns the list of count arrays, one per pack.
+
+    """
+    fracs = iter(fracs)
+    counts = []
+    for pack in scenario.packs:
+        if pack.num == 0:
+            counts.append(numpy.zeros(scenario.nb_slots - pack.nb_slots + 1,
+                                      int))
+            continue
+        cumcount = numpy.round(pack.num * numpy.cumsum(next(fracs)))
+        counts.append(numpy.diff(numpy.concatenate(([0], cumcount)))
+                      .astype(int))
+    return counts
+
+def lower_bound(scenario=None, rel_gap=1e-4, max_iter=10000,
+                max_time=10.):
+    """Bound the minimum GC of a scenario from below and from above.
+
+    Arguments are those of relaxation.
+
+    Returns the lower bound of the relaxation and the GC of an actual
+    schedule: the rounded solution of the relaxation, improved by passes of
+    sequential best responses of the game until they lower the potential by
+    at most rel_gap times its value (see strats.game.Scheduler).
+
+    """
+    scenario = scenario or Settings.get_scenario()
+    lower, fracs = relaxation(scenario, rel_gap, max_iter, max_time)
+    slots = numpy.concatenate([numpy.repeat(numpy.arange(len(count)), count)
+                               for count in rounded_counts(scenario, fracs)])
+    sched = game.Scheduler(10, scenario, tol=rel_gap, start_slots=slots)
+    sched.schedule_tasks()
+    return lower, sched.get_global_cost()
+
+################################################################################
+
+if __name__ == "__main__":
+    import sys
+    for name in sys.argv[1:] or ['heterogeneous.in', 'residential.in']:
+        Settings.from_file(name)
+        start = time.time()
+        lower, upper = lower_bound()
+        print '%s: %.4f <= min GC <= %.4f (%.2f s)' % (
+            name, lower, upper, time.time() - start)
@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# scenarios.py
+# This file is part of DR StratComp.
+#
+# Copyright (C) 2010 - Stéphane Caron
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import itertools
+import json
+import math
+import numpy
+import os
+import struct
+
+from scheduling import Scenario
+
+"""Reading and writing scenarios in text and binary formats.
+
+The binary format is a memory-mappable layout: a magic string, the length of a
+JSON header, the header (scalar parameters, number of packs and offsets of the
+arrays) and the little-endian arrays of pack sizes, durations and instant
+costs, each aligned on 64 bytes. Reading it maps the arrays without copying
+them. Scenarios can be converted, or generated at scale, e.g.:
+
+    % python scenarios.py convert settings/residential.in residential.scn
+    % python scenarios.py generate big.scn --jobs 1000000 --slots 1440 --binary
+
+"""
+
+
+MAGIC = 'DRSCN\x01'
+
+_ALIGN = 64
+_ARRAYS = [('nums', '<i4'), ('taus', '<i4'), ('costs', '<f8')]
+
+
+def _aligned(offset):
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+def is_binary(path):
+    """Check whether a file is a binary scenario."""
+    f = open(path, 'rb')
+    try:
+        return f.read(len(MAGIC)) == MAGIC
+    finally:
+        f.close()
+
+def _create_binary(path, header):
+    """Write the header of a binary scenario and reserve room for its arrays.
+
+    Returns the file, open for writing, and the offsets of the arrays.
+
+    """
+    # Offsets depend on the header length, which depends on the offsets: the
+    # second pass lays out arrays after a header with the offsets of the
+    # first pass, plus some slack for their extra digits.
+    offsets = [0] * len(_ARRAYS)
+    for i in range(2):
+        header['offsets'] = offsets
+        text = json.dumps(header, sort_keys=True) + ' ' * 20
+        offset = _aligned(len(MAGIC) + 4 + len(text))
+        for (k, (_, dtype)) in enumerate(_ARRAYS):
+            offsets[k] = offset
+            offset = _aligned(offset + header['nb_packs'] *
+                              numpy.dtype(dtype).itemsize)
+    text = json.dumps(header, sort_keys=True)
+    f = open(path, 'wb')
+    f.write(MAGIC + struct.pack('<I', len(text)) + text)
+    f.truncate(offset)
+    return f, offsets
+
+def _write_chunk(f, offsets, start, arrays):
+    """Write arrays of packs, from the start-th pack on, in a binary file."""
+    for (a, offset, (_, dtype)) in zip(arrays, offsets, _ARRAYS):
+        a = numpy.ascontiguousarray(a, dtype)
+        f.seek(offset + start * a.itemsize)
+        f.write(a.tostring())
+
+def write_binary(scenario, path):
+    """Write a scenario in the binary format.
+
+    Arguments:
+    scenario -- Scenario instance
+    path -- output file
+
+    """
+    header = {'L': scenario.L, 'nb_slots': scenario.nb_slots,
+              'C0': scenario.C0, 'C1': scenario.C1, 'T': scenario.T,
+              'name': scenario.name, 'nb_packs': len(scenario.arrays[0])}
+    f, offsets = _create_binary(path, header)
+    try:
+        _write_chunk(f, offsets, 0, scenario.arrays)
+    finally:
+        f.close()
+
+def read_binary(path, mmap=True):
+    """Read a scenario in the binary format.
+
+    Arguments:
+    path -- input file
+    mmap -- map the arrays of the file read-only instead of reading them
+
+    """
+    f = open(path, 'rb')
+    try:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise Exception("Not a binary scenario: %s" % path)
+        length, = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(length))
+        arrays = []
+        for ((_, dtype), offset) in zip(_ARRAYS, header['offsets']):
+            if mmap:
+                arrays.append(numpy.memmap(path, dtype, 'r', offset,
+                                           (header['nb_packs'],)))
+            else:
+                f.seek(offset)
+                arrays.append(numpy.fromfile(f, dtype, header['nb_packs']))
+    finally:
+        f.close()
+    nums, taus, costs = arrays
+    return Scenario.from_arrays(header['L'], header['nb_slots'], header['C0'],
+                                header['C1'], nums, taus, costs, header['T'],
+                                str(header['name']))
+
+def _write_text_header(f, L, nb_slots, C0, C1, nb_packs):
+    f.write('L = %r kW\n' % L)
+    f.write('nb_slots = %d slots\n' % nb_slots)
+    f.write('C0 = %r $/kW/s\n' % C0)
+    f.write('C1 = %r $/kW^2/s\n\n' % C1)
+    f.write('%d\n' % nb_packs)
+
+def write_text(scenario, path):
+    """Write a scenario in the text format of the settings/ directory."""
+    nums, taus, costs = scenario.arrays
+    f = open(path, 'w')
+    try:
+        _write_text_header(f, scenario.L, scenario.nb_slots, scenario.C0,
+                           scenario.C1, len(nums))
+        numpy.savetxt(f, numpy.column_stack((nums, taus, costs)),
+                      '%d %d %r')
+    finally:
+        f.close()
+
+def load(path):
+    """Read a scenario from any path, in the text or the binary format."""
+    if is_binary(path):
+        return read_binary(path)
+    return Scenario.from_file(path, os.curdir)
+
+def convert(src, dst, binary=True):
+    """Convert a scenario file to the binary (or text) format.
+
+    Arguments:
+    src -- input file, in either format
+    dst -- output file
+    binary -- write the binary format if True, the text format otherwise
+
+    """
+    scenario = load(src)
+    if binary:
+        write_binary(scenario, dst)
+    else:
+        write_text(scenario, dst)
+
+# Number of packs drawn from each random stream of a synthetic scenario.
+
+_BLOCK = 2**12
+
+def _synthetic_block(block, nb_packs, nb_slots, seed, tau_median, tau_sigma,
+                     cost_scale, cost_alpha):
+    """Draw the durations and instant costs of a block of synthetic packs.
+
+    Each block has its own stream, seeded by the master seed and the block
+    index, so that packs do not depend on how blocks are grouped in chunks.
+
+    """
+    rs = numpy.random.RandomState([seed, block])
+    n = min(_BLOCK, nb_packs - block * _BLOCK)
+    taus = numpy.clip(numpy.round(tau_median * rs.lognormal(0., tau_sigma, n)),
+                      1, max(nb_slots - 1, 1)).astype(int)
+    costs = numpy.round(cost_scale * (rs.pareto(cost_alpha, n) + 1.), 3)
+    return taus, costs
+
+def _synthetic_chunks(nb_jobs, nb_slots, seed, pack_size, tau_median,
+                      tau_sigma, cost_scale, cost_alpha, chunk_size):
+    """Generate the packs of a synthetic scenario chunk by chunk.
+
+    The same seed always yields the same packs, whatever the chunk size, so
+    that scenarios can be generated in two passes without being held in
+    memory.
+
+    """
+    nb_packs = -(-nb_jobs // pack_size)
+    for start in range(0, nb_packs, chunk_size):
+        n = min(chunk_size, nb_packs - start)
+        nums = numpy.minimum(pack_size, nb_jobs - pack_size *
+                             numpy.arange(start, start + n))
+        first, last = start // _BLOCK, (start + n - 1) // _BLOCK
+        blocks = [_synthetic_block(b, nb_packs, nb_slots, seed, tau_median,
+                                   tau_sigma, cost_scale, cost_alpha)
+                  for b in range(first, last + 1)]
+        offset = start - first * _BLOCK
+        taus = numpy.concatenate([t for (t, _) in blocks])[offset:offset + n]
+        costs = numpy.concatenate([c for (_, c) in blocks])[offset:offset + n]
+        yield start, nums, taus, costs
+
+def generate(path, nb_jobs, nb_slots, seed=None, L=None, overload=1.2,
+             pack_size=1, tau_median=None, tau_sigma=1., cost_scale=1.,
+             cost_alpha=2.5, C0=2.8e-6, C1=2.8e-8, binary=False,
+             chunk_size=2**16):
+    """Write a synthetic scenario with heavy-tailed durations and loads.
+
+    Durations are log-normal, clipped to [1, nb_slots - 1] so that every job
+    has at least two possible start slots, and instant costs follow a Pareto
+    distribution. Packs are generated by chunks, twice: the
+    first pass computes the total area of jobs to choose (or check) L, and
+    the second pass writes them.
+
+    Arguments:
+    path -- output file
+    nb_jobs -- number of jobs
+    nb_slots -- number of time slots
+    seed -- seed of the generator (random if None)
+    L -- capacity (default: area of jobs / (nb_slots * overload))
+    overload -- ratio of the average load to L when L is None
+    pack_size -- number of identical jobs per pack line
+    tau_median -- median duration in slots (default: nb_slots / 12)
+    tau_sigma -- log-normal shape of durations (heavier tail when larger)
+    cost_scale -- minimum instant cost
+    cost_alpha -- Pareto shape of instant costs (heavier tail when smaller)
+    C0 -- constant part of the cost function
+    C1 -- overage part of the cost function
+    binary -- write the binary format instead of the text format
+    chunk_size -- number of packs generated at once
+
+    Returns the capacity L of the scenario.
+
+    """
+    if seed is None:
+        seed = numpy.random.randint(2**31 - 1)
+    if tau_median is None:
+        tau_median = max(1., nb_slots / 12.)
+    chunks = lambda: _synthetic_chunks(nb_jobs, nb_slots, seed, pack_size,
+                                       tau_median, tau_sigma, cost_scale,
+                                       cost_alpha, chunk_size)
+    area = math.fsum(itertools.chain.from_iterable(
+        nums * taus * costs for (_, nums, taus, costs) in chunks()))
+    if L is None:
+        L = area / (nb_slots * overload)
+    elif area < L * nb_slots:
+        raise Exception("Non-triviality criterion not met: jobs area %g < "
+                        "L * nb_slots = %g" % (area, L * nb_slots))
+    nb_packs = -(-nb_jobs // pack_size)
+    if binary:
+        header = {'L': L, 'nb_slots': nb_slots, 'C0': C0, 'C1': C1,
+                  'T': 6. * 3600., 'name': os.path.basename(path),
+                  'nb_packs': nb_packs}
+        f, offsets = _create_binary(path, header)
+        try:
+            for (start, nums, taus, costs) in chunks():
+                _write_chunk(f, offsets, start, (nums, taus, costs))
+        finally:
+            f.close()
+    else:
+        f = open(path, 'w')
+        try:
+            _write_text_header(f, L, nb_slots, C0, C1, nb_packs)
+            for (start, nums, taus, costs) in chunks():
+                numpy.savetxt(f, numpy.column_stack((nums, taus, costs)),
+                              '%d %d %.3f')
+        finally:
+            f.close()
+    return L
+
+################################################################################
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Convert or generate scenarios.")
+    commands = parser.add_subparsers(dest='command')
+    conv = commands.add_parser('convert', help="convert between formats")
+    conv.add_argument('src', help="input scenario, in either format")
+    conv.add_argument('dst', help="output scenario")
+    conv.add_argument('--text', action='store_true',
+                      help="write the text format instead of the binary one")
+    gen = commands.add_parser('generate', help="write a synthetic scenario")
+    gen.add_argument('dst', help="output scenario")
+    gen.add_argument('--jobs', type=int, required=True)
+    gen.add_argument('--slots', type=int, required=True)
+    gen.add_argument('--seed', type=int)
+    gen.add_argument('--L', type=float, help="capacity (default: from "
+                     "--overload)")
+    gen.add_argument('--overload', type=float, default=1.2)
+    gen.add_argument('--pack-size', type=int, default=1)
+    gen.add_argument('--tau-median', type=float)
+    gen.add_argument('--tau-sigma', type=float, default=1.)
+    gen.add_argument('--cost-scale', type=float, default=1.)
+    gen.add_argument('--cost-alpha', type=float, default=2.5)
+    gen.add_argument('--binary', action='store_true')
+    args = parser.parse_args()
+    if args.command == 'convert':
+        convert(args.src, args.dst, not args.text)
+    else:
+        generate(args.dst, args.jobs, args.slots, args.seed, args.L,
+                 args.overload, args.pack_size, args.tau_median,
+                 args.tau_sigma, args.cost_scale, args.cost_alpha,
+                 binary=args.binary)
@@ -20,8 +20,11 @@
 # this program. If not, see <http://www.gnu.org/licenses/>.
 #
 
-import matplotlib.pyplot as pyplot
+import hashlib
+import json
 import numpy
+import os
+import time
 
 
 class Task:
@@ -42,64 +45,345 @@ class Task:
         self.nb_slots = tau
         self.inst_cost = d
 
-    def duration(self):
-        """Compute task's duration in seconds."""
-        return (float(self.nb_slots) / Settings.nb_slots) * Settings.T
+    def duration(self, scenario=None):
+        """Compute task's duration in seconds.
+
+        Arguments:
+        scenario -- Scenario instance (defaults to Settings.get_scenario())
+
+        """
+        scenario = scenario or Settings.get_scenario()
+        return (float(self.nb_slots) / scenario.nb_slots) * scenario.T
+
+
+class Pack:
+
+    """Class of identical jobs, i.e. a pack line in a settings file."""
+
+    def __init__(self, num, d, tau):
+        """Constructor for a pack.
+
+        Arguments:
+        num -- number of jobs in the pack
+        d -- instant cost of each job
+        tau -- duration of each job (number of slots)
+
+        """
+
+        self.num = num
+        self.nb_slots = tau
+        self.inst_cost = d
+
+    def duration(self, scenario=None):
+        """Compute the duration in seconds of one job of the pack.
+
+        Arguments:
+        scenario -- Scenario instance (defaults to Settings.get_scenario())
+
+        """
+        scenario = scenario or Settings.get_scenario()
+        return (float(self.nb_slots) / scenario.nb_slots) * scenario.T
+
+    def tasks(self, first_id):
+        """Materialize the jobs of the pack as Task instances.
+
+        Arguments:
+        first_id -- identifier of the first job, next ones are consecutive
+
+        """
+        return [Task(first_id + k, self.inst_cost, self.nb_slots)
+                for k in range(self.num)]
+
+
+class Scenario(object):
+
+    """Immutable description of a scheduling problem.
+
+    A scenario gathers the capacity L, the number of slots, the cost
+    coefficients C0 and C1, the total duration T and the packs of jobs. It is
+    passed explicitly to schedulers, so that several scenarios can be
+    simulated side by side in threads or worker processes.
+
+    """
+
+    def __init__(self, L, nb_slots, C0, C1, packs, T=6. * 3600.,
+                 name='default.in'):
+        """Constructor for a scenario.
+
+        Arguments:
+        L -- capacity above which the overage cost applies
+        nb_slots -- number of time slots
+        C0 -- constant part of the cost function
+        C1 -- overage part of the cost function
+        packs -- list of Pack instances
+        T -- total duration, in seconds
+        name -- name of the scenario, e.g. its settings file
+
+        """
+        set_attr = lambda key, value: object.__setattr__(self, key, value)
+        set_attr('L', float(L))
+        set_attr('nb_slots', int(nb_slots))
+        set_attr('C0', float(C0))
+        set_attr('C1', float(C1))
+        set_attr('T', float(T))
+        set_attr('name', name)
+        set_attr('_packs', None if packs is None else tuple(packs))
+        set_attr('_arrays', None)
+        set_attr('_tasks', None)
+        set_attr('_fingerprint', None)
+
+    @classmethod
+    def from_arrays(cls, L, nb_slots, C0, C1, nums, taus, costs,
+                    T=6. * 3600., name='default.in'):
+        """Create a scenario from the arrays describing its packs.
+
+        Arrays are used as is (without copy), so that they can be memory
+        mapped. Pack instances are only materialized on demand.
+
+        Arguments:
+        nums -- array of the numbers of jobs of each pack
+        taus -- array of the durations of each pack (number of slots)
+        costs -- array of the instant costs of each pack
+
+        Other arguments are those of the constructor.
+
+        """
+        scenario = cls(L, nb_slots, C0, C1, None, T, name)
+        object.__setattr__(scenario, '_arrays', (nums, taus, costs))
+        return scenario
+
+    def __setattr__(self, key, value):
+        raise AttributeError("Scenario instances are immutable.")
+
+    def __delattr__(self, key):
+        raise AttributeError("Scenario instances are immutable.")
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_tasks'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    @property
+    def file(self):
+        """Alias of the scenario name, as in Settings.file."""
+        return self.name
+
+    @property
+    def packs(self):
+        """Packs of the scenario as Pack instances, materialized on demand."""
+        if self._packs is None:
+            object.__setattr__(self, '_packs', tuple(
+                Pack(num, d, tau) for (num, tau, d) in zip(
+                    *[a.tolist() for a in self._arrays])))
+        return self._packs
+
+    @property
+    def arrays(self):
+        """Sizes, durations and instant costs of all packs as three arrays."""
+        if self._arrays is None:
+            object.__setattr__(self, '_arrays', (
+                numpy.array([pack.num for pack in self._packs], int),
+                numpy.array([pack.nb_slots for pack in self._packs], int),
+                numpy.array([pack.inst_cost for pack in self._packs],
+                            float)))
+        return self._arrays
+
+    @property
+    def tasks(self):
+        """Jobs of the scenario as Task instances, materialized on demand."""
+        if self._tasks is None:
+            tasks, next_id = [], 0
+            for pack in self.packs:
+                tasks.extend(pack.tasks(next_id))
+                next_id += pack.num
+            object.__setattr__(self, '_tasks', tuple(tasks))
+        return self._tasks
+
+    @classmethod
+    def from_file(cls, file, directory='settings'):
+        """Read a scenario from a configuration file.
+
+        Pack lines are parsed in bulk into arrays, unless they carry extra
+        text, in which case only their first three fields are read.
+
+        Arguments:
+        file -- name of the file, or path of the file if it has a directory
+            part (e.g. ./my.in)
+        directory -- directory of the file, if file is a bare name
+
+        """
+        path = file if os.path.dirname(file) else os.path.join(directory,
+                                                               file)
+        f = open(path, 'r')
+        try:
+            L = float(f.readline().split()[2])
+            nb_slots = int(f.readline().split()[2])
+            C0 = float(f.readline().split()[2])
+            C1 = float(f.readline().split()[2])
+            f.readline() # skip blank line
+            nb_lines = int(f.readline().split()[0])
+            body = f.read()
+        finally:
+            f.close()
+        values = numpy.fromstring(body, sep=' ')
+        if len(values) != 3 * nb_lines:
+            lines = body.splitlines()[:nb_lines]
+            values = numpy.array([line.split()[:3] for line in lines], float)
+        values = values.reshape((nb_lines, 3))
+        nums, taus = values[:, 0].astype(int), values[:, 1].astype(int)
+        costs = values[:, 2].copy()
+        if (nums * taus * costs).sum() < L * nb_slots:
+            print "Warning: non-triviality criterion not met!"
+        return cls.from_arrays(L, nb_slots, C0, C1, nums, taus, costs,
+                               name=os.path.basename(file))
+
+    def min_cost(self):
+        """Compute the constant part of GC."""
+        nums, taus, costs = self.arrays
+        dt = self.T / self.nb_slots
+        return self.C0 * float((nums * taus * dt * costs).sum())
+
+    def fingerprint(self):
+        """Hash of the content of the scenario (its name excluded).
+
+        The hash is computed once, from the raw bytes of the pack arrays, and
+        kept since scenarios are immutable.
+
+        """
+        if self._fingerprint is None:
+            nums, taus, costs = self.arrays
+            sha = hashlib.sha1(repr((self.L, self.nb_slots, self.C0, self.C1,
+                                     self.T, len(nums))))
+            for (array, dtype) in ((nums, '<i8'), (taus, '<i8'),
+                                   (costs, '<f8')):
+                sha.update(numpy.ascontiguousarray(array, dtype).data)
+            object.__setattr__(self, '_fingerprint', sha.hexdigest())
+        return self._fingerprint
 
 
 class Settings:
 
     """Global settings for the current run.
 
-    All the settings (number of slots, tasks, etc.) are stored in static members
-    of this class. Data can be read from input files using the from_file method.
+    Compatibility layer over Scenario: the scenario read by from_file becomes
+    the default one for schedulers created without an explicit scenario, and
+    its attributes are mirrored in static members of this class.
 
     """
 
     T = 6. * 3600. # 6 hours, in seconds
     L, nb_slots, C0, C1 = 0, 0, 0, 0
     file = 'default.in'
+    packs = []
     tasks = []
+    scenario = None
 
     @classmethod
     def from_file(cls, file):
         """Read settings for the current run from a configuration file."""
-        Settings.tasks = []
-        Settings.file = file
-        f = open('settings/' + file, 'r')
-        Settings.L = float(f.readline().split()[2])
-        Settings.nb_slots = int(f.readline().split()[2])
-        Settings.C0 = float(f.readline().split()[2])
-        Settings.C1 = float(f.readline().split()[2])
-        f.readline() # skip blank line
-        nb_lines = int(f.readline().split()[0])
-        next_id, jobs_area = 0, 0
-        for lid in range(nb_lines):
-            line = f.readline()
-            num = int(line.split()[0])
-            tau = int(line.split()[1])
-            d = float(line.split()[2])
-            for k in range(num):
-                Settings.tasks.append(Task(next_id, d, tau))
-                next_id += 1
-            jobs_area += num * d * tau
-        if jobs_area < Settings.L * Settings.nb_slots:
-            print "Warning: non-triviality criterion not met!"
-        f.close()
+        Settings.use(Scenario.from_file(file))
+
+    @classmethod
+    def use(cls, scenario):
+        """Make a Scenario instance the default one for the current run."""
+        Settings.scenario = scenario
+        Settings.T = scenario.T
+        Settings.L = scenario.L
+        Settings.nb_slots = scenario.nb_slots
+        Settings.C0 = scenario.C0
+        Settings.C1 = scenario.C1
+        Settings.file = scenario.name
+        Settings.packs = list(scenario.packs)
+        Settings.tasks = list(scenario.tasks)
+
+    @classmethod
+    def get_scenario(cls):
+        """Get the default Scenario instance of the current run."""
+        if Settings.scenario is None:
+            raise Exception("No scenario loaded.")
+        return Settings.scenario
 
     @classmethod
     def min_cost(cls):
         """Compute the constant part of GC."""
-        return Settings.C0 * sum(t.duration() * t.inst_cost
-                                 for t in Settings.tasks)
+        return Settings.get_scenario().min_cost()
+
+
+class Stats:
+
+    """Counters and timers of instrumented runs.
+
+    Schedulers and load profiles only update counters when a Stats instance
+    is attached to them (see Scheduler.instrument), so that instrumentation
+    costs a single attribute test per call when disabled. Statistics of
+    several runs can be merged and exported as JSON. Results of runs, such as
+    their GC, are kept per run rather than added up.
+
+    """
+
+    def __init__(self):
+        self.runs = 1
+        self.counters = {}
+        self.timers = {}
+        self.global_costs = []
+
+    def count(self, name, n=1):
+        """Increment a counter."""
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_time(self, name, seconds):
+        """Add time spent in a given phase."""
+        self.timers[name] = self.timers.get(name, 0.) + seconds
+
+    def merge(self, other):
+        """Add the counters and timers of another Stats instance."""
+        self.runs += other.runs
+        self.global_costs.extend(other.global_costs)
+        for (name, n) in other.counters.items():
+            self.count(name, n)
+        for (name, seconds) in other.timers.items():
+            self.add_time(name, seconds)
+
+    def as_dict(self):
+        """Export statistics as a dictionary."""
+        return {'runs': self.runs, 'counters': dict(self.counters),
+                'timers': dict(self.timers),
+                'global_costs': list(self.global_costs)}
+
+    @classmethod
+    def from_dict(cls, d):
+        """Import statistics exported by as_dict."""
+        stats = cls()
+        stats.runs = d['runs']
+        stats.counters = dict(d['counters'])
+        stats.timers = dict(d['timers'])
+        stats.global_costs = list(d.get('global_costs', []))
+        return stats
+
+    def to_json(self):
+        """Export statistics as a JSON string."""
+        return json.dumps(self.as_dict(), sort_keys=True)
 
 
 class LoadProfile:
 
     """Manages insertion/deletion of load on time slots intervals."""
 
-    def __init__(self):
-        self.inst_load = dict((t, 0) for t in range(Settings.nb_slots))
+    stats = None
+
+    def __init__(self, scenario=None):
+        """Create an empty load profile.
+
+        Arguments:
+        scenario -- Scenario instance (defaults to Settings.get_scenario())
+
+        """
+        self.scenario = scenario or Settings.get_scenario()
+        self.inst_load = numpy.zeros(self.scenario.nb_slots)
+        self.version = 0
 
     def add_load(self, slot_len, inst_cost, time_slot):
         """Add load on a given time slots interval.
@@ -110,32 +394,56 @@ class LoadProfile:
         time_slot -- start time slot
 
         """
-        if time_slot < 0 or time_slot + slot_len > Settings.nb_slots:
+        if time_slot < 0 or time_slot + slot_len > self.scenario.nb_slots:
+            raise Exception("Invalid scheduling.")
+        self.inst_load[time_slot:time_slot + slot_len] += inst_cost
+        self.version += 1
+        if self.stats is not None:
+            self.stats.count('slot_updates', slot_len)
+
+    def add_loads(self, slot_lens, inst_costs, time_slots):
+        """Add load on several time slots intervals at once.
+
+        Arguments are sequences of the same length, with the same meaning as
+        in add_load. Intervals are applied through a difference array, so the
+        cost of a call is O(len(time_slots) + nb_slots).
+
+        """
+        S = self.scenario.nb_slots
+        slot_lens = numpy.asarray(slot_lens, int)
+        inst_costs = numpy.asarray(inst_costs, float)
+        time_slots = numpy.asarray(time_slots, int)
+        if len(time_slots) == 0:
+            return
+        if time_slots.min() < 0 or (time_slots + slot_lens).max() > S:
             raise Exception("Invalid scheduling.")
-        for u in range(time_slot, time_slot + slot_len):
-            self.inst_load[u] += inst_cost
+        diff = numpy.bincount(time_slots, inst_costs, S + 1) \
+            - numpy.bincount(time_slots + slot_lens, inst_costs, S + 1)
+        self.inst_load += numpy.cumsum(diff[:S])
+        self.version += 1
+        if self.stats is not None:
+            self.stats.count('slot_updates', int(slot_lens.sum()))
 
     def get_load(self, time_slot):
         """Get load at a given time slot."""
-        if 0 <= time_slot < Settings.nb_slots:
+        if 0 <= time_slot < self.scenario.nb_slots:
             return self.inst_load[time_slot]
         else:
             return 0
 
     def get_par(self):
         """Compute the peak-to-average ratio (PAR) of the load profile."""
-        average = sum(self.inst_load.values()) / Settings.nb_slots
-        peak = max(self.inst_load.values())
-        return peak / average
+        return self.inst_load.max() / self.inst_load.mean()
 
     def plot(self):
         """Plot the current load profile."""
-        xvals = range(Settings.nb_slots)
-        yvals = self.inst_load.values()
+        import matplotlib.pyplot as pyplot
+        xvals = range(self.scenario.nb_slots)
+        yvals = self.inst_load
         pyplot.bar(xvals, yvals, width=1, color='y')
         pyplot.xlabel('Time slot')
         pyplot.ylabel('Load (kW)')
-        pyplot.xlim(xmin=0, xmax=Settings.nb_slots)
+        pyplot.xlim(xmin=0, xmax=self.scenario.nb_slots)
         pyplot.grid(True)
 
 
@@ -143,9 +451,32 @@ class Scheduler:
 
     """Abstract class for a scheduling policy."""
 
-    def __init__(self):
+    stats = None
+
+    def __init__(self, scenario=None):
+        """Initiate a new scheduler.
+
+        Arguments:
+        scenario -- Scenario instance (defaults to Settings.get_scenario())
+
+        """
+        self.scenario = scenario or Settings.get_scenario()
         self._sched_slots = {}
-        self.load_profile = LoadProfile()
+        self._cost_prefix = (None, None)
+        self.load_profile = LoadProfile(self.scenario)
+
+    def instrument(self, stats=None):
+        """Attach a Stats instance to the scheduler and its load profile.
+
+        Arguments:
+        stats -- Stats instance to update (a new one if None)
+
+        Returns the attached Stats instance.
+
+        """
+        self.stats = stats or Stats()
+        self.load_profile.stats = self.stats
+        return self.stats
 
     def is_scheduled(self, task):
         """Find if a given Task instance has been scheduled yet."""
@@ -153,6 +484,8 @@ class Scheduler:
 
     def schedule_task(self, task, time_slot):
         """Schedule a Task instant at given time slot."""
+        if self.stats is not None:
+            self.stats.count('schedule_task')
         if not self.is_scheduled(task):
             self.load_profile.add_load(task.nb_slots, task.inst_cost,
                                        time_slot)
@@ -160,27 +493,84 @@ class Scheduler:
         else:
             raise Exception("Task already scheduled.")
 
+    def schedule_many(self, tasks, time_slots):
+        """Schedule several Task instances at once.
+
+        Arguments:
+        tasks -- list of Task instances, none of which is scheduled yet
+        time_slots -- start time slot of each task
+
+        """
+        if self.stats is not None:
+            self.stats.count('schedule_task', len(tasks))
+        time_slots = [int(t) for t in time_slots]
+        ids = set(task.id for task in tasks)
+        if len(ids) < len(tasks) or any(map(self.is_scheduled, tasks)):
+            raise Exception("Task already scheduled.")
+        self.load_profile.add_loads([task.nb_slots for task in tasks],
+                                    [task.inst_cost for task in tasks],
+                                    time_slots)
+        for task, time_slot in zip(tasks, time_slots):
+            self._sched_slots[task.id] = time_slot
+
     def reschedule_task(self, task, time):
         """Removes previous scheduling of task if any and schedule it again."""
+        if self.stats is not None:
+            self.stats.count('reschedule_task')
         if self.is_scheduled(task):
             self.load_profile.add_load(task.nb_slots, -task.inst_cost,
                 self.get_task_slot(task))
             del self._sched_slots[task.id]
         self.schedule_task(task, time)
 
+    def reschedule_many(self, tasks, time_slots):
+        """Move several scheduled Task instances at once.
+
+        Arguments:
+        tasks -- list of distinct Task instances, all already scheduled
+        time_slots -- new start time slot of each task
+
+        """
+        if self.stats is not None:
+            self.stats.count('reschedule_task', len(tasks))
+        time_slots = [int(t) for t in time_slots]
+        slot_lens = [task.nb_slots for task in tasks]
+        inst_costs = numpy.array([task.inst_cost for task in tasks], float)
+        old_slots = map(self.get_task_slot, tasks)
+        self.load_profile.add_loads(slot_lens + slot_lens,
+                                    numpy.concatenate((-inst_costs,
+                                                       inst_costs)),
+                                    old_slots + time_slots)
+        for task, time_slot in zip(tasks, time_slots):
+            self._sched_slots[task.id] = time_slot
+
     def utility_cost(self, load):
-        """Compute the ramp cost for a given instant load."""
-        if load <= Settings.L:
-            return Settings.C0
-        return Settings.C0 + Settings.C1 * (load - Settings.L)
+        """Compute the ramp cost for a given instant load (or load array)."""
+        scenario = self.scenario
+        return scenario.C0 + scenario.C1 * numpy.maximum(load - scenario.L, 0)
+
+    def cost_prefix(self):
+        """Get the prefix sums of the per-slot cost of the load profile.
+
+        Entry t of the returned array is the total cost of a unit load on time
+        slots [0, t). It is computed in a single pass over slots and cached
+        until the load profile changes.
+
+        """
+        version, prefix = self._cost_prefix
+        if version != self.load_profile.version:
+            dt = self.scenario.T / self.scenario.nb_slots
+            loads = self.load_profile.inst_load
+            prefix = numpy.zeros(self.scenario.nb_slots + 1)
+            numpy.cumsum(self.utility_cost(loads) * dt, out=prefix[1:])
+            self._cost_prefix = (self.load_profile.version, prefix)
+        return prefix
 
     def integrate_cost(self, start, stop):
         """Compute the total cost on a given time interval (bounds included)."""
-        if 0 <= start <= stop < Settings.nb_slots:
-            dt = Settings.T / Settings.nb_slots
-            load = lambda t: self.load_profile.get_load(t)
-            cost = lambda l: self.utility_cost(l)
-            return sum(cost(load(t)) * dt for t in range(start, stop + 1))
+        if 0 <= start <= stop < self.scenario.nb_slots:
+            prefix = self.cost_prefix()
+            return prefix[stop + 1] - prefix[start]
         else:
             raise Exception("Invalid integration bounds.")
 
@@ -197,6 +587,124 @@ class Scheduler:
         return task.inst_cost * \
             self.integrate_cost(time_slot, time_slot + task.nb_slots - 1)
 
+    def get_bills(self, tasks=None):
+        """Compute the costs experienced by the customers of several jobs.
+
+        Arguments:
+        tasks -- list of Task instances (defaults to all tasks)
+
+        Returns an array with the cost of each job, in the order of tasks.
+
+        """
+        if tasks is None:
+            tasks = self.scenario.tasks
+        prefix = self.cost_prefix()
+        slots = numpy.array([self.get_task_slot(task) for task in tasks], int)
+        taus = numpy.array([task.nb_slots for task in tasks], int)
+        costs = numpy.array([task.inst_cost for task in tasks], float)
+        return costs * (prefix[slots + taus] - prefix[slots])
+
     def get_global_cost(self):
         """Compute the Global Cost experienced by the system."""
-        return sum([self.get_task_cost(task) for task in Settings.tasks])
+        if self.stats is None:
+            return self.get_bills().sum()
+        start = time.time()
+        self._cost_prefix = (None, None)
+        gc = self.get_bills().sum()
+        self.stats.add_time('global_cost', time.time() - start)
+        return gc
+
+    def profile(self, stats=None):
+        """Schedule all tasks and compute GC with instrumentation enabled.
+
+        Arguments:
+        stats -- Stats instance to update (a new one if None)
+
+        Returns the Stats instance, with the GC of the run appended to its
+        global_costs list.
+
+        """
+        stats = self.instrument(stats)
+        start = time.time()
+        self.schedule_tasks()
+        stats.add_time('schedule', time.time() - start)
+        stats.global_costs.append(float(self.get_global_cost()))
+        return stats
+
+
+def pack_arrays(scenario):
+    """Get sizes, durations and instant costs of all packs as three arrays."""
+    return scenario.arrays
+
+def step_replicas(scenario, replicas, admission_probs, stats=None):
+    """Run a slot-driven policy on several independent replicas at once.
+
+    Replicas advance together slot by slot. Jobs of a pack are identical, so
+    each replica only keeps the number of pending jobs per pack: at each slot,
+    the number of admitted jobs of a pack is drawn from a binomial law with
+    the probability given by admission_probs, and admitted jobs are added to
+    the load of their replica with a vectorized range update.
+
+    Arguments:
+    scenario -- Scenario instance
+    replicas -- number of independent runs
+    admission_probs -- function (time_slot, prev_load) -> probabilities, where
+        prev_load is the array of replica loads at time_slot - 1 and the
+        result broadcasts to shape (replicas, nb_packs); NaN or infinite
+        probabilities raise an exception
+    stats -- Stats instance counting admission attempts (optional)
+
+    Returns the (replicas, nb_slots) array of load profiles.
+
+    """
+    S = scenario.nb_slots
+    nums, taus, costs = pack_arrays(scenario)
+    nb_packs = len(nums)
+    max_tau = taus.max()
+    ends = numpy.zeros((nb_packs, max_tau + 1))
+    ends[numpy.arange(nb_packs), taus] = costs
+    pending = numpy.tile(nums, (replicas, 1))
+    departures = numpy.zeros((replicas, S + max_tau + 1))
+    loads = numpy.zeros((replicas, S))
+    cur_load = numpy.zeros(replicas)
+    for t in range(S):
+        if stats is not None:
+            stats.count('admission_attempts', int(pending.sum()))
+        probs = admission_probs(t, cur_load)
+        if not numpy.isfinite(probs).all():
+            raise Exception("Invalid admission probabilities at slot %d." % t)
+        probs = numpy.clip(probs, 0., 1.)
+        admitted = numpy.random.binomial(pending, probs)
+        pending -= admitted
+        cur_load = cur_load - departures[:, t] + admitted.dot(costs)
+        departures[:, t:t + max_tau + 1] += admitted.dot(ends)
+        loads[:, t] = cur_load
+    return loads
+
+def gc_from_loads(loads, scenario=None):
+    """Compute the Global Cost of one or several load profiles at once.
+
+    Each task pays utility_cost(load) on every slot it covers, weighted by its
+    own instant cost, so GC is also the sum over slots of utility_cost(load)
+    times load. This function evaluates it along the last axis of loads.
+
+    Arguments:
+    loads -- array of shape (nb_slots,) or (nb_runs, nb_slots)
+    scenario -- Scenario instance (defaults to Settings.get_scenario())
+
+    """
+    scenario = scenario or Settings.get_scenario()
+    loads = numpy.asarray(loads, dtype=float)
+    dt = scenario.T / scenario.nb_slots
+    costs = scenario.C0 + scenario.C1 * numpy.maximum(loads - scenario.L, 0.)
+    return dt * (costs * loads).sum(axis=-1)
+
+def par_from_loads(loads):
+    """Compute the PAR of one or several load profiles at once.
+
+    Arguments:
+    loads -- array of shape (nb_slots,) or (nb_runs, nb_slots)
+
+    """
+    loads = numpy.asarray(loads, dtype=float)
+    return loads.max(axis=-1) / loads.mean(axis=-1)
@@ -0,0 +1,458 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# service.py
+# This file is part of DR StratComp.
+#
+# Copyright (C) 2010 - Stéphane Caron
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import Queue
+import SocketServer
+import json
+import numpy
+import os
+import random
+import signal
+import socket
+import sys
+import threading
+import time
+
+from scheduling import Settings
+from streaming import Job, StreamScheduler
+
+"""Long-running scheduling service.
+
+The service keeps a scenario and the live load of the next nb_slots slots in
+memory, and answers requests sent as JSON objects, one per line, over a Unix
+socket or a localhost TCP port:
+
+    {"op": "submit", "id": 7, "d": 2.5, "tau": 4}  -> {"id": 7, "slot": 12}
+    {"op": "cancel", "id": 7}        -> {"id": 7, "cancelled": true}
+    {"op": "advance", "slots": 1}    -> {"t": 10, "global_cost": ...}
+    {"op": "load"}                   -> {"t": 10, "load": [...]}
+    {"op": "stats"}                  -> latency and throughput figures
+
+Time only moves forward on advance requests. A submitted job must run
+within the next nb_slots slots and is answered at once with its start slot,
+chosen by the policy of the service (see streaming.StreamScheduler). Requests
+of all connections go through a single queue and are decided by one thread,
+by batches of all the requests waiting in the queue, so that the live load
+needs no lock and concurrent requests share the hand-offs between threads.
+
+    % python service.py serve --socket /tmp/drs.sock --strategy game
+    % python service.py bench --socket /tmp/drs.sock --clients 8
+
+"""
+
+
+class OnlineScheduler(StreamScheduler):
+
+    """Rolling-horizon scheduler deciding jobs as they are submitted."""
+
+    def __init__(self, policy, scenario=None):
+        """Initiate a new scheduler (see StreamScheduler)."""
+        StreamScheduler.__init__(self, policy, scenario)
+        self.jobs = {}
+        self._ends = {}
+
+    def submit(self, id, d, tau):
+        """Decide the start slot of a new job arriving at the current slot.
+
+        Slot-driven policies (e.g. ALOHA-like) are played forward on the
+        planned load of the next slots, until they start the job or it
+        reaches its deadline.
+
+        Arguments:
+        id -- unique identifier among jobs not completed yet
+        d -- instant cost (finite and non-negative)
+        tau -- duration (integer number of slots)
+
+        Returns the start slot of the job.
+
+        """
+        if id in self.jobs:
+            raise Exception("Job %r already submitted." % (id,))
+        if isinstance(d, bool) or not isinstance(d, (int, long, float)) or \
+                not 0 <= d < float('inf'):
+            raise Exception("Invalid instant cost: %r." % (d,))
+        if isinstance(tau, bool) or not isinstance(tau, (int, long)) or \
+                not 1 <= tau <= self.scenario.nb_slots:
+            raise Exception("Invalid duration: %r." % (tau,))
+        t = self.ring.start
+        job = Job(id, float(d), int(tau), t, self.scenario.nb_slots)
+        slot = None
+        for s in xrange(t, job.deadline + 1):
+            slot = self.policy.plan(job, s, self.ring)
+            if slot is not None:
+                break
+        if slot is None:
+            slot = job.deadline
+        self.ring.add_load(job.nb_slots, job.inst_cost, slot)
+        self.jobs[id] = (job, slot)
+        self._ends.setdefault(slot + job.nb_slots, []).append(id)
+        self.nb_jobs += 1
+        return slot
+
+    def cancel(self, id):
+        """Cancel a job that has not started yet.
+
+        Returns whether the job was cancelled.
+
+        """
+        job, slot = self.jobs.get(id, (None, None))
+        if job is None or slot < self.ring.start:
+            return False
+        self.ring.add_load(job.nb_slots, -job.inst_cost, slot)
+        del self.jobs[id]
+        self._ends[slot + job.nb_slots].remove(id)
+        self.nb_jobs -= 1
+        return True
+
+    def advance(self, nb_slots=1):
+        """Retire the next time slots and forget the jobs completed."""
+        for i in range(nb_slots):
+            self._retire()
+            for id in self._ends.pop(self.ring.start, []):
+                del self.jobs[id]
+
+
+class SchedulingService:
+
+    """Request queue and decision thread around an OnlineScheduler."""
+
+    def __init__(self, policy, scenario=None, max_batch=256, window=0.,
+                 history=2**16):
+        """Initiate a new service.
+
+        Arguments:
+        policy -- policy of the scheduler (see streaming.StreamScheduler)
+        scenario -- Scenario instance (defaults to Settings.get_scenario())
+        max_batch -- maximum number of requests decided at once
+        window -- time to wait for more requests before deciding a batch,
+            in seconds (0: only batch requests already waiting)
+        history -- number of latest request latencies kept for percentiles
+
+        """
+        self.sched = OnlineScheduler(policy, scenario)
+        self.max_batch = max_batch
+        self.window = window
+        self.nb_requests = 0
+        self.nb_batches = 0
+        self._latencies = numpy.zeros(history)
+        self._queue = Queue.Queue()
+        self._thread = None
+        self.started = None
+
+    def start(self):
+        """Start the decision thread."""
+        self.started = time.time()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Decide the requests already queued and stop the decision thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def request(self, message):
+        """Queue a request and wait for its response.
+
+        Arguments:
+        message -- request dictionary (see the module documentation)
+
+        Returns the response dictionary, with an 'error' key if the request
+        failed.
+
+        """
+        pending = [message, None, threading.Event(), time.time()]
+        self._queue.put(pending)
+        pending[2].wait()
+        return pending[1]
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            if self.window > 0.:
+                time.sleep(self.window)
+            try:
+                while len(batch) < self.max_batch and batch[-1] is not None:
+                    batch.append(self._queue.get_nowait())
+            except Queue.Empty:
+                pass
+            for pending in batch:
+                if pending is not None:
+                    pending[1] = self._handle(pending[0])
+            done = time.time()
+            for pending in batch:
+                if pending is not None:
+                    k = self.nb_requests % len(self._latencies)
+                    self._latencies[k] = done - pending[3]
+                    self.nb_requests += 1
+                    pending[2].set()
+            self.nb_batches += 1
+            if batch[-1] is None:
+                return
+
+    def _handle(self, message):
+        sched = self.sched
+        try:
+            op = message['op']
+            if op == 'submit':
+                slot = sched.submit(message['id'], message['d'],
+                                    message['tau'])
+                return {'id': message['id'], 'slot': slot}
+            elif op == 'cancel':
+                return {'id': message['id'],
+                        'cancelled': sched.cancel(message['id'])}
+            elif op == 'advance':
+                sched.advance(message.get('slots', 1))
+                return {'t': sched.ring.start,
+                        'global_cost': sched.global_cost,
+                        'peak_load': sched.peak_load}
+            elif op == 'load':
+                return {'t': sched.ring.start, 'load': sched.ring.window(
+                    sched.ring.start, sched.scenario.nb_slots).tolist()}
+            elif op == 'stats':
+                return self.stats()
+            raise Exception("Unknown operation: %r." % (op,))
+        except Exception, e:
+            return {'error': str(e)}
+
+    def stats(self):
+        """Get a dictionary of latency (in seconds) and throughput figures.
+
+        Latencies run from the queuing of a request to its response, and
+        percentiles are computed over the latest history requests.
+
+        """
+        latencies = self._latencies[:min(self.nb_requests,
+                                         len(self._latencies))]
+        p50, p99 = numpy.percentile(latencies, [50, 99]) \
+            if len(latencies) > 0 else (0., 0.)
+        uptime = time.time() - self.started
+        return {'requests': self.nb_requests, 'batches': self.nb_batches,
+                'mean_batch': self.nb_requests / max(1., self.nb_batches),
+                'latency_p50': p50, 'latency_p99': p99,
+                'throughput': self.nb_requests / max(uptime, 1e-9),
+                'uptime': uptime, 't': self.sched.ring.start,
+                'jobs': len(self.sched.jobs),
+                'global_cost': self.sched.global_cost,
+                'peak_load': self.sched.peak_load}
+
+################################################################################
+
+class _Handler(SocketServer.StreamRequestHandler):
+
+    def setup(self):
+        SocketServer.StreamRequestHandler.setup(self)
+        if self.connection.family != socket.AF_UNIX:
+            self.connection.setsockopt(socket.IPPROTO_TCP,
+                                       socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                message = json.loads(line)
+            except ValueError, e:
+                reply = {'error': str(e)}
+            else:
+                reply = self.server.service.request(message)
+            self.wfile.write(json.dumps(reply) + '\n')
+
+
+class _UnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+class _TCPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def make_server(service, address):
+    """Create a server answering the requests of a service.
+
+    Arguments:
+    service -- SchedulingService instance
+    address -- path of a Unix socket, or port number on localhost
+
+    Returns the server; call its serve_forever method to run it.
+
+    """
+    if isinstance(address, int):
+        server = _TCPServer(('127.0.0.1', address), _Handler)
+    else:
+        if os.path.exists(address):
+            os.remove(address)
+        server = _UnixServer(address, _Handler)
+    server.service = service
+    return server
+
+
+class Client:
+
+    """Blocking client of a scheduling service."""
+
+    def __init__(self, address):
+        """Connect to a service (see make_server for the address)."""
+        if isinstance(address, int):
+            self.sock = socket.create_connection(('127.0.0.1', address))
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(address)
+        self.rfile = self.sock.makefile('rb')
+
+    def request(self, message):
+        """Send a request dictionary and return the response dictionary."""
+        self.sock.sendall(json.dumps(message) + '\n')
+        return json.loads(self.rfile.readline())
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+
+def load_test(address, clients=8, requests=1000, scenario=None,
+              cancel_ratio=.1, advance_every=100, seed=None):
+    """Benchmark a running service with concurrent clients.
+
+    Each client thread submits jobs drawn from the packs of a scenario, with
+    probability proportional to their sizes, and cancels a fraction of them
+    right away. The first client also advances time every advance_every
+    requests.
+
+    Arguments:
+    address -- address of the service (see make_server)
+    clients -- number of concurrent connections
+    requests -- number of requests per client
+    scenario -- Scenario instance giving jobs (defaults to
+        Settings.get_scenario())
+    cancel_ratio -- fraction of submitted jobs cancelled
+    advance_every -- period of advance requests (None: never)
+    seed -- seed of the jobs
+
+    Returns a dictionary of client-side latency (in seconds) and throughput
+    figures, and of the statistics of the service ('service').
+
+    """
+    scenario = scenario or Settings.get_scenario()
+    nums, taus, costs = scenario.arrays
+    weights = numpy.asarray(nums, float) / numpy.sum(nums)
+    rs = numpy.random.RandomState(seed)
+    prefix = rs.randint(2**31 - 1)
+    latencies = [[] for c in range(clients)]
+    def run(c, packs, draws):
+        client = Client(address)
+        try:
+            k = 0
+            while k < requests:
+                job_id = '%d-%d-%d' % (prefix, c, k)
+                messages = [{'op': 'submit', 'id': job_id,
+                             'd': float(costs[packs[k]]),
+                             'tau': int(taus[packs[k]])}]
+                if draws[k] < cancel_ratio:
+                    messages.append({'op': 'cancel', 'id': job_id})
+                if c == 0 and advance_every and k % advance_every == 0:
+                    messages.append({'op': 'advance', 'slots': 1})
+                for message in messages[:requests - k]:
+                    start = time.time()
+                    client.request(message)
+                    latencies[c].append(time.time() - start)
+                    k += 1
+        finally:
+            client.close()
+    threads = [threading.Thread(target=run, args=(
+        c, rs.choice(len(weights), requests, p=weights),
+        rs.random_sample(requests))) for c in range(clients)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.time() - start
+    client = Client(address)
+    try:
+        service_stats = client.request({'op': 'stats'})
+    finally:
+        client.close()
+    latencies = numpy.concatenate(latencies)
+    p50, p99 = numpy.percentile(latencies, [50, 99])
+    return {'requests': len(latencies), 'seconds': seconds,
+            'throughput': len(latencies) / seconds, 'latency_p50': p50,
+            'latency_p99': p99, 'service': service_stats}
+
+################################################################################
+
+if __name__ == "__main__":
+    import argparse
+    from strats import aloha, game, timeslack, uniform
+    parser = argparse.ArgumentParser(description="Scheduling service.")
+    commands = parser.add_subparsers(dest='command')
+    serve = commands.add_parser('serve', help="run the service")
+    bench = commands.add_parser('bench', help="benchmark a running service")
+    for command in (serve, bench):
+        group = command.add_mutually_exclusive_group(required=True)
+        group.add_argument('--socket', help="path of a Unix socket")
+        group.add_argument('--port', type=int, help="port on localhost")
+        command.add_argument('--settings', default='residential.in')
+        command.add_argument('--seed', type=int)
+    serve.add_argument('--strategy', default='game',
+                       choices=['aloha', 'game', 'timeslack', 'uniform'])
+    serve.add_argument('--max-batch', type=int, default=256)
+    serve.add_argument('--window', type=float, default=0.,
+                       help="seconds to wait for more requests per batch")
+    bench.add_argument('--clients', type=int, default=8)
+    bench.add_argument('--requests', type=int, default=1000,
+                       help="requests per client")
+    args = parser.parse_args()
+    address = args.socket or args.port
+    Settings.from_file(args.settings)
+    if args.command == 'serve':
+        random.seed(args.seed)
+        numpy.random.seed(args.seed)
+        policies = {'aloha': lambda: aloha.Policy(.2, 0),
+                    'game': game.Policy,
+                    'timeslack': lambda: timeslack.Policy(.06),
+                    'uniform': uniform.Policy}
+        service = SchedulingService(policies[args.strategy](),
+                                    max_batch=args.max_batch,
+                                    window=args.window)
+        service.start()
+        server = make_server(service, address)
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            service.stop()
+            if args.socket and os.path.exists(args.socket):
+                os.remove(args.socket)
+    else:
+        r = load_test(address, args.clients, args.requests, seed=args.seed)
+        s = r['service']
+        print '%d requests in %.2f s: %.0f requests/s, latency p50 %.1f us, ' \
+            'p99 %.1f us' % (r['requests'], r['seconds'], r['throughput'],
+                             1e6 * r['latency_p50'], 1e6 * r['latency_p99'])
+        print 'Service: %.1f requests per batch, latency p50 %.1f us, p99 ' \
+            '%.1f us, GC %.4f at slot %d' % (
+                s['mean_batch'], 1e6 * s['latency_p50'],
+                1e6 * s['latency_p99'], s['global_cost'], s['t'])
@@ -20,7 +20,6 @@
 # this program. If not, see <http://www.gnu.org/licenses/>.
 #
 
-import matplotlib.pyplot as plt
 import numpy
 import random
 import sys
@@ -34,15 +33,16 @@ class Scheduler(scheduling.Scheduler):
 
     """Scheduler for the ALOHA-like policy."""
 
-    def __init__(self, prob_safe, prob_overage):
+    def __init__(self, prob_safe, prob_overage, scenario=None):
         """Initiate a new scheduler.
         
         Arguments:
         prob_safe -- scheduling probability when there is no overage
         prob_overage -- scheduling probability otherwise
+        scenario -- Scenario instance (defaults to Settings.get_scenario())
 
         """
-        scheduling.Scheduler.__init__(self)
+        scheduling.Scheduler.__init__(self, scenario)
         self.prob_safe = prob_safe
         self.prob_overage = prob_overage
 
@@ -51,15 +51,18 @@ class Scheduler(scheduling.Scheduler):
         def schedule_with_prob(task, slot, p):
             if numpy.random.uniform() < p:
                 self.schedule_task(task, slot)
-        next_tasks = list(Settings.tasks)
-        for time_slot in range(Settings.nb_slots):
+        scenario = self.scenario
+        next_tasks = list(scenario.tasks)
+        for time_slot in range(scenario.nb_slots):
             prev_cost = self.load_profile.get_load(time_slot - 1)
             cur_tasks = next_tasks
             next_tasks = []
+            if self.stats is not None:
+                self.stats.count('admission_attempts', len(cur_tasks))
             for task in cur_tasks:
-                if time_slot == Settings.nb_slots - task.nb_slots:
+                if time_slot == scenario.nb_slots - task.nb_slots:
                     self.schedule_task(task, time_slot)
-                elif prev_cost + task.inst_cost < Settings.L:
+                elif prev_cost + task.inst_cost < scenario.L:
                     schedule_with_prob(task, time_slot, self.prob_safe)
                 else:
                     schedule_with_prob(task, time_slot, self.prob_overage)
@@ -67,8 +70,87 @@ class Scheduler(scheduling.Scheduler):
                     next_tasks.append(task)
 
 
-def sample_gc(prob_safe, prob_overage):
-    """Compute GC for a sample run of an ALOHA-like scheduler."""
-    sched = Scheduler(prob_safe, prob_overage)
+class Policy:
+
+    """ALOHA-like policy for streams of jobs (see streaming.StreamScheduler).
+    """
+
+    def __init__(self, prob_safe, prob_overage, scenario=None):
+        """Initiate a new policy.
+
+        Arguments:
+        prob_safe -- scheduling probability when there is no overage
+        prob_overage -- scheduling probability otherwise
+        scenario -- Scenario instance (defaults to Settings.get_scenario())
+
+        """
+        self.scenario = scenario or Settings.get_scenario()
+        self.prob_safe = prob_safe
+        self.prob_overage = prob_overage
+
+    def plan(self, job, t, ring):
+        """Start job at slot t with the ALOHA-like probability."""
+        if ring.get_load(t - 1) + job.inst_cost < self.scenario.L:
+            p = self.prob_safe
+        else:
+            p = self.prob_overage
+        return t if numpy.random.uniform() < p else None
+
+
+def sample_loads(prob_safe, prob_overage, replicas, scenario=None,
+                 stats=None):
+    """Draw the load profiles of several independent runs at once.
+
+    Arguments:
+    prob_safe -- scheduling probability when there is no overage
+    prob_overage -- scheduling probability otherwise
+    replicas -- number of independent runs
+    scenario -- Scenario instance (defaults to Settings.get_scenario())
+    stats -- scheduling.Stats instance counting admission attempts
+
+    Returns an array of shape (replicas, nb_slots).
+
+    """
+    scenario = scenario or Settings.get_scenario()
+    nums, taus, costs = scheduling.pack_arrays(scenario)
+    def admission_probs(time_slot, prev_cost):
+        safe = prev_cost[:, numpy.newaxis] + costs < scenario.L
+        probs = numpy.where(safe, prob_safe, prob_overage)
+        probs[:, time_slot == scenario.nb_slots - taus] = 1.
+        return probs
+    return scheduling.step_replicas(scenario, replicas, admission_probs,
+                                    stats)
+
+def sample_gc(prob_safe, prob_overage, replicas=None, scenario=None):
+    """Compute GC for a sample run of an ALOHA-like scheduler.
+
+    Arguments:
+    prob_safe -- scheduling probability when there is no overage
+    prob_overage -- scheduling probability otherwise
+    replicas -- if set, return the GCs of that many independent runs
+    scenario -- Scenario instance (defaults to Settings.get_scenario())
+
+    """
+    if replicas is not None:
+        loads = sample_loads(prob_safe, prob_overage, replicas, scenario)
+        return scheduling.gc_from_loads(loads, scenario)
+    sched = Scheduler(prob_safe, prob_overage, scenario)
     sched.schedule_tasks()
     return sched.get_global_cost()
+
+def sample_par(prob_safe, prob_overage, replicas=None, scenario=None):
+    """Compute the PAR for a sample run of an ALOHA-like scheduler.
+
+    Arguments:
+    prob_safe -- scheduling probability when there is no overage
+    prob_overage -- scheduling probability otherwise
+    replicas -- if set, return the PARs of that many independent runs
+    scenario -- Scenario instance (defaults to Settings.get_scenario())
+
+    """
+    if replicas is not None:
+        return scheduling.par_from_loads(sample_loads(prob_safe, prob_overage,
+                                                      replicas, scenario))
+    sched = Scheduler(prob_safe, prob_overage, scenario)
+    sched.schedule_tasks()
+    return sched.load_profile.get_par()
@@ -20,85 +20,475 @@
 # this program. If not, see <http://www.gnu.org/licenses/>.
 #
 
+import json
+import numpy
+import os
 import random
 import sys
+import threading
+import time
 
 sys.path.append('..')
-from scheduling import Settings
 import scheduling
 
 
+# Window sums are computed by differences of prefix sums, so two windows with
+# the same exact load may differ by a few ULPs. Ties are detected up to this
+# relative tolerance (w.r.t. the total load) to keep them exact.
+
+_TIE_RTOL = 1e-12
+
+# Simultaneous best responses evaluate (players x windows) cost matrices by
+# chunks of at most this many entries.
+
+_CHUNK_SIZE = 2**20
+
+# Simultaneous plays move fewer players per pass than sequential ones, since
+# stale best responses are damped, but passes are much cheaper. Their budget
+# of plays is this many times the sequential one, and passes stop earlier as
+# soon as they converge.
+
+_SIMULTANEOUS_BUDGET = 10
+
+# Default interval between checkpoints, in seconds.
+
+CHECKPOINT_SECONDS = 60.
+
+
 class Scheduler(scheduling.Scheduler):
 
     """Scheduler implementing the cooperative game between players."""
 
-    def __init__(self, rounds_ratio):
+    def __init__(self, rounds_ratio, scenario=None, tol=None, batch=None,
+                 accept=1., start_slots=None, checkpoint=None,
+                 checkpoint_seconds=CHECKPOINT_SECONDS):
         """Initiate a new scheduler.
 
         Arguments:
         rounds_ratio -- number of rounds will be len(tasks) * (1 + nb_rounds)
-        
+        scenario -- Scenario instance (defaults to Settings.get_scenario())
+        tol -- if not None, stop as soon as a full pass over all players
+            decreases the potential by at most tol times its value (tol=0
+            stops at a Nash equilibrium); rounds_ratio then bounds the
+            number of additional rounds
+        batch -- if not None, players play simultaneously by batches of
+            this size, until convergence (see play_simultaneous)
+        accept -- probability that an improving player of a batch moves
+        start_slots -- initial start slots of the tasks of the scenario, in
+            order (random if None)
+        checkpoint -- file where the state of schedule_tasks is saved
+            periodically; if it exists, schedule_tasks resumes from it, and
+            it is removed once all rounds are played
+        checkpoint_seconds -- interval between checkpoints
+
         """
-        scheduling.Scheduler.__init__(self)
+        scheduling.Scheduler.__init__(self, scenario)
         self.rounds_ratio = rounds_ratio
+        self.tol = tol
+        self.batch = batch
+        self.accept = accept
+        self.start_slots = start_slots
+        self.checkpoint = checkpoint
+        self.checkpoint_seconds = checkpoint_seconds
+        self._next_checkpoint = None
+        self._writer = None
+        self.rounds_used = None
+        self.converged = None
+        self.trace = None
+
+    def potential(self):
+        """Potential of the congestion game, i.e. half the sum of squared
+        instant loads over all time slots.
+
+        A best response of player i moving from window W to window W' lowers
+        the potential by d_i * (load of others over W - load of others over
+        W'), which is the decrease of the player's own cost.
+
+        """
+        inst_load = self.load_profile.inst_load
+        return .5 * float(inst_load.dot(inst_load))
 
     def schedule_tasks(self):
         """Make all consumers play reschedule their job once, then play
         additional nb_rounds * len(tasks) rounds where players are selected
         uniformly at random.
 
+        Each play is a best response computed in O(S): the player's own load
+        is removed from the live load profile, then the load seen by each
+        candidate window is read from prefix sums. The player picks uniformly
+        at random among the cheapest windows.
+
+        If tol is not None, additional rounds are instead played by passes
+        over all players in random order. A play improves the potential when
+        the player was not already on one of its cheapest windows. Passes
+        stop when their relative improvement of the potential is at most tol
+        or when the round budget is exhausted. The number of additional
+        rounds played, whether the criterion was met and the potential after
+        the initial sweep and each pass are then stored in rounds_used,
+        converged and trace.
+
+        If batch is not None, the initial sweep and additional rounds are
+        replaced by simultaneous plays (see play_simultaneous).
+
+        If checkpoint is not None, the start slots, load profile, states of
+        the random streams and position in the rounds are saved every
+        checkpoint_seconds. A scheduler with the same parameters resumes
+        from this state and ends as the interrupted run would have.
+
         """
         def randslot(task):
-            return random.randint(0, Settings.nb_slots - task.nb_slots)
-        tasks = list(Settings.tasks)
-        slots = dict((t.id, randslot(t)) for t in tasks)
+            return random.randint(0, self.scenario.nb_slots - task.nb_slots)
+        tasks = list(self.scenario.tasks)
+        progress = self._resume(tasks)
+        if progress is None:
+            if self.start_slots is None:
+                self.schedule_many(tasks, map(randslot, tasks))
+            else:
+                self.schedule_many(tasks, self.start_slots)
+            progress = {'phase': 'sweep', 'position': 0}
+        if self.batch is not None:
+            self.play_simultaneous(tasks, progress)
+            self._end_checkpoints()
+            return
         def play(cur_task):
-            #print "play", cur_task.id, "scheduled at time", slots[cur_task.id]
+            if self.stats is not None:
+                self.stats.count('game_plays')
             tau_i = cur_task.nb_slots
-            def H_j(other_task, t):
-                d_j = other_task.inst_cost
-                t_j = slots[other_task.id]
-                tau_j = other_task.nb_slots
-                DF_j = lambda t: (t_j - tau_i <= t < t_j)
-                return (-d_j) * (DF_j(t) - DF_j(t - tau_j))
-            H = lambda t: sum(H_j(other_task, t)
-                for other_task in tasks if other_task.id != cur_task.id)
-            H_dict = dict((t, H(t)) for t in range(Settings.nb_slots))
-            #print " ", H_dict
-            H_sum = lambda t: sum(H_dict[u]
-                                  for u in range(t, Settings.nb_slots))
-            H_sums = [H_sum(t) for t in range(Settings.nb_slots - tau_i + 1)]
-            #print " ", H_sums
-            min_sum = min(H_sums)
-            min_pos = [t for t,v in enumerate(H_sums) if v == min_sum]
-            new_time = random.choice(min_pos)
-            slots[cur_task.id] = new_time
+            t_i = self.get_task_slot(cur_task)
+            load = self.load_profile.inst_load.copy()
+            load[t_i:t_i + tau_i] -= cur_task.inst_cost
+            cumload = numpy.concatenate(([0.], numpy.cumsum(load)))
+            win_sums = cumload[tau_i:] - cumload[:-tau_i]
+            min_sum = win_sums.min()
+            tol = _TIE_RTOL * abs(cumload).max()
+            min_pos = list(numpy.flatnonzero(win_sums <= min_sum + tol))
+            new_time = int(random.choice(min_pos))
             self.reschedule_task(cur_task, new_time)
-        map(play, tasks)
+            if win_sums[t_i] <= min_sum + tol:
+                return 0.
+            return cur_task.inst_cost * (win_sums[t_i] - min_sum)
+        phase, position = progress['phase'], progress['position']
+        if phase == 'sweep':
+            for i in xrange(position, len(tasks)):
+                if self._checkpoint_due():
+                    self._save_checkpoint(tasks, {'phase': 'sweep',
+                                                  'position': i})
+                play(tasks[i])
+            position = 0
         nb_rounds = len(tasks) * self.rounds_ratio
-        for i in range(nb_rounds):
-            play(random.choice(tasks))
-        #print slots
+        if self.tol is None:
+            for i in xrange(position, nb_rounds):
+                if self._checkpoint_due():
+                    self._save_checkpoint(tasks, {'phase': 'rounds',
+                                                  'position': i})
+                play(random.choice(tasks))
+            self._end_checkpoints()
+            return
+        if phase == 'passes':
+            potential, gain = progress['potential'], progress['gain']
+            self.trace = progress['trace']
+            self.rounds_used = progress['rounds_used']
+            order = progress['order']
+        else:
+            potential = self.potential()
+            self.trace = [potential]
+            self.rounds_used = 0
+            order = None
+        self.converged = False
+        while self.rounds_used < nb_rounds and not self.converged:
+            if order is None:
+                order = random.sample(xrange(len(tasks)), len(tasks))
+                order = order[:nb_rounds - self.rounds_used]
+                gain, position = 0., 0
+            for i in xrange(position, len(order)):
+                if self._checkpoint_due():
+                    self._save_checkpoint(tasks, {
+                        'phase': 'passes', 'position': i, 'gain': gain,
+                        'potential': potential, 'trace': self.trace,
+                        'rounds_used': self.rounds_used}, order=order)
+                gain += play(tasks[order[i]])
+            self.rounds_used += len(order)
+            potential -= gain
+            self.trace.append(potential)
+            self.converged = (len(order) == len(tasks)
+                              and gain <= self.tol * potential)
+            order = None
+        self._end_checkpoints()
+
+    def _config(self):
+        return {'scenario': self.scenario.fingerprint(),
+                'rounds_ratio': self.rounds_ratio, 'tol': self.tol,
+                'batch': self.batch, 'accept': self.accept}
+
+    def _checkpoint_due(self):
+        return self.checkpoint is not None and \
+            time.time() >= self._next_checkpoint
+
+    def _save_checkpoint(self, tasks, progress, slots=None, order=None):
+        """Save the state of schedule_tasks to the checkpoint file.
+
+        The state is copied, then written by a background thread, so that
+        plays go on while the file is compressed and written.
+
+        Arguments:
+        tasks -- list of scheduled Task instances
+        progress -- dictionary locating the current play in schedule_tasks
+        slots -- current start slots of tasks (read from the scheduler if
+            None)
+        order -- order of the players of the current pass (if any)
+
+        """
+        if slots is None:
+            slots = map(self.get_task_slot, tasks)
+        py_state = random.getstate()
+        np_state = numpy.random.get_state()
+        meta = {'config': self._config(), 'progress': progress,
+                'random': [py_state[0], py_state[2]],
+                'numpy': [np_state[0]] + list(np_state[2:])}
+        arrays = {'slots': numpy.array(slots, numpy.int32),
+                  'load': self.load_profile.inst_load.copy(),
+                  'random_key': numpy.array(py_state[1], numpy.int64),
+                  'numpy_key': np_state[1].copy()}
+        if order is not None:
+            arrays['order'] = numpy.array(order, numpy.int32)
+        if self._writer is not None:
+            self._writer.join()
+        self._writer = threading.Thread(target=_write_checkpoint,
+                                        args=(self.checkpoint, meta, arrays))
+        self._writer.start()
+        self._next_checkpoint = time.time() + self.checkpoint_seconds
+
+    def _resume(self, tasks):
+        """Restore the state saved in the checkpoint file, if any.
+
+        Returns the progress of the saved state, or None if there is no
+        checkpoint to resume from.
+
+        """
+        if self.checkpoint is None:
+            return None
+        self._next_checkpoint = time.time() + self.checkpoint_seconds
+        if not os.path.exists(self.checkpoint):
+            return None
+        data = numpy.load(self.checkpoint)
+        try:
+            meta = json.loads(str(data['meta']))
+            if meta['config'] != self._config():
+                raise Exception("Checkpoint %s was saved by another "
+                                "scheduler." % self.checkpoint)
+            self.schedule_many(tasks, data['slots'])
+            self.load_profile.inst_load[:] = data['load']
+            version, gauss = meta['random']
+            random.setstate((version, tuple(data['random_key'].tolist()),
+                             gauss))
+            name, pos, has_gauss, cached = meta['numpy']
+            numpy.random.set_state((str(name), data['numpy_key'], pos,
+                                    has_gauss, cached))
+            progress = meta['progress']
+            if 'order' in data.files:
+                progress['order'] = data['order'].tolist()
+        finally:
+            data.close()
+        return progress
+
+    def _end_checkpoints(self):
+        """Wait for the last checkpoint and remove the checkpoint file."""
+        if self._writer is not None:
+            self._writer.join()
+            self._writer = None
+        if self.checkpoint is not None and os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+
+    def best_responses(self, slots, taus, costs):
+        """Compute best responses of players against the current load profile.
+
+        Players are grouped by duration tau. For a player of instant cost d
+        currently at slot t_i, the load of others over the window starting at
+        t is the load over that window minus d * max(0, tau - |t - t_i|), so
+        that the costs of all windows of a group are one vectorized
+        evaluation. Ties are broken uniformly at random.
+
+        Arguments:
+        slots -- array of current start slots of the players
+        taus -- array of durations (in slots) of the players
+        costs -- array of instant costs of the players
+
+        Returns the arrays of best start slots and of cost improvements
+        (zero for players already on one of their cheapest windows).
+
+        """
+        load = self.load_profile.inst_load
+        cumload = numpy.concatenate(([0.], numpy.cumsum(load)))
+        tol = _TIE_RTOL * abs(cumload).max()
+        best, gains = slots.copy(), numpy.zeros(len(slots))
+        for tau in numpy.unique(taus):
+            win_sums = cumload[tau:] - cumload[:-tau]
+            windows = numpy.arange(len(win_sums))
+            group = numpy.flatnonzero(taus == tau)
+            chunk = max(1, _CHUNK_SIZE / len(win_sums))
+            for start in range(0, len(group), chunk):
+                idx = group[start:start + chunk]
+                overlap = numpy.maximum(0, tau - abs(windows[None, :] -
+                                                     slots[idx, None]))
+                others = win_sums[None, :] - costs[idx, None] * overlap
+                min_sums = others.min(axis=1)
+                ties = others <= (min_sums + tol)[:, None]
+                keys = numpy.where(ties, numpy.random.random_sample(
+                    others.shape), -1.)
+                best[idx] = keys.argmax(axis=1)
+                cur_sums = others[numpy.arange(len(idx)), slots[idx]]
+                gains[idx] = numpy.where(cur_sums > min_sums + tol,
+                                         costs[idx] * (cur_sums - min_sums),
+                                         0.)
+        return best, gains
+
+    def play_simultaneous(self, tasks, progress=None):
+        """Play passes of simultaneous best responses by batches of players.
+
+        Each pass goes over all players in random order, by batches of
+        self.batch players. All players of a batch compute best responses
+        against the same load profile (see best_responses), then each
+        improving player moves with probability accept. Moving only a random
+        subset damps the oscillations that occur when players flee the same
+        congested slots at once. If the moves of a batch would not decrease
+        the potential, the move probability is halved until they do (a single
+        best response always does).
+
+        Passes stop when a pass improves the potential by at most tol times
+        its value (tol=0, or None, stops at a Nash equilibrium), or after
+        _SIMULTANEOUS_BUDGET * len(tasks) * (1 + rounds_ratio) plays.
+        rounds_used, converged and trace are set as for sequential plays.
+
+        Arguments:
+        tasks -- list of scheduled Task instances
+        progress -- progress restored from a checkpoint (see schedule_tasks)
+
+        """
+        nb_plays = _SIMULTANEOUS_BUDGET * len(tasks) * (1 + self.rounds_ratio)
+        tol = self.tol or 0.
+        slots = numpy.array(map(self.get_task_slot, tasks))
+        taus = numpy.array([task.nb_slots for task in tasks])
+        costs = numpy.array([task.inst_cost for task in tasks], float)
+        if progress is not None and progress['phase'] == 'simultaneous':
+            plays, gain = progress['plays'], progress['gain']
+            self.trace = progress['trace']
+            order = numpy.array(progress['order'])
+            position = progress['position']
+        else:
+            plays = 0
+            self.trace = [self.potential()]
+            order = None
+        self.converged = False
+        while plays < nb_plays and not self.converged:
+            if order is None:
+                order = random.sample(xrange(len(tasks)), len(tasks))
+                order = numpy.array(order[:nb_plays - plays])
+                gain, position = 0., 0
+            for start in range(position, len(order), self.batch):
+                if self._checkpoint_due():
+                    self._save_checkpoint(tasks, {
+                        'phase': 'simultaneous', 'position': start,
+                        'plays': plays, 'gain': gain, 'trace': self.trace},
+                        slots, order)
+                batch = order[start:start + self.batch]
+                best, gains = self.best_responses(slots[batch], taus[batch],
+                                                  costs[batch])
+                gain += gains.sum()
+                moves = self._accepted_moves(slots[batch], best, taus[batch],
+                                             costs[batch], gains)
+                self.reschedule_many([tasks[k] for k in batch[moves]],
+                                     best[moves])
+                slots[batch[moves]] = best[moves]
+            plays += len(order)
+            if self.stats is not None:
+                self.stats.count('game_plays', len(order))
+            self.trace.append(self.potential())
+            self.converged = (len(order) == len(tasks)
+                              and gain <= tol * self.trace[-1])
+            order = None
+        self.rounds_used = plays - len(tasks)
+
+    def _accepted_moves(self, slots, best, taus, costs, gains):
+        if gains.max() <= 0.:
+            return numpy.array([], int)
+        load = self.load_profile.inst_load
+        S = len(load)
+        rate = self.accept
+        draws = numpy.random.random_sample(len(gains))
+        while True:
+            moves = numpy.flatnonzero((gains > 0.) & (draws < rate))
+            if len(moves) <= 1:
+                return moves if len(moves) else numpy.array([gains.argmax()])
+            d = costs[moves]
+            diff = numpy.bincount(best[moves], d, S + 1) \
+                - numpy.bincount(best[moves] + taus[moves], d, S + 1) \
+                - numpy.bincount(slots[moves], d, S + 1) \
+                + numpy.bincount(slots[moves] + taus[moves], d, S + 1)
+            delta = numpy.cumsum(diff[:S])
+            if load.dot(delta) + .5 * delta.dot(delta) < 0.:
+                return moves
+            rate /= 2.
+
+
+def _write_checkpoint(path, meta, arrays):
+    """Write a checkpoint atomically, as a compressed numpy archive."""
+    tmp_path = path + '.tmp'
+    f = open(tmp_path, 'wb')
+    try:
+        numpy.savez_compressed(f, meta=json.dumps(meta), **arrays)
+    finally:
+        f.close()
+    os.rename(tmp_path, path)
+
+
+class Policy:
+
+    """Best-response policy for streams of jobs (see
+    streaming.StreamScheduler).
+
+    Each job plays once, at arrival, a best response against the load of
+    the jobs already scheduled, i.e. picks one of the windows of least load
+    among its admissible ones. Jobs do not move afterwards.
+
+    """
+
+    def plan(self, job, t, ring):
+        """Start job on a window of least load."""
+        tau = job.nb_slots
+        load = ring.window(t, job.deadline + tau - t)
+        cumload = numpy.concatenate(([0.], numpy.cumsum(load)))
+        win_sums = cumload[tau:] - cumload[:-tau]
+        tol = _TIE_RTOL * abs(cumload).max()
+        min_pos = numpy.flatnonzero(win_sums <= win_sums.min() + tol)
+        return t + int(random.choice(min_pos))
 
 
-def sample_gc(ratio=2):
+def sample_gc(ratio=2, scenario=None, tol=None, batch=None, accept=1.):
     """Compute GC for a sample run of the game.
 
     Arguments:
     ratio -- number of additional rounds / number of tasks
+    scenario -- Scenario instance (defaults to Settings.get_scenario())
+    tol -- convergence tolerance (see Scheduler)
+    batch -- batch size of simultaneous plays (see Scheduler)
+    accept -- move probability of simultaneous plays (see Scheduler)
 
     """
-    sched = Scheduler(ratio)
+    sched = Scheduler(ratio, scenario, tol, batch, accept)
     sched.schedule_tasks()
     return sched.get_global_cost()
 
-def sample_par(ratio=2):
+def sample_par(ratio=2, scenario=None, tol=None, batch=None, accept=1.):
     """Compute the PAR for a sample run of the game.
 
     Arguments:
     ratio -- number of additional rounds / number of tasks
+    scenario -- Scenario instance (defaults to Settings.get_scenario())
+    tol -- convergence tolerance (see Scheduler)
+    batch -- batch size of simultaneous plays (see Scheduler)
+    accept -- move probability of simultaneous plays (see Scheduler)
 
     """
-    sched = Scheduler(ratio)
+    sched = Scheduler(ratio, scenario, tol, batch, accept)
     sched.schedule_tasks()
     return sched.load_profile.get_par()
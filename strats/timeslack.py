@@ -20,7 +20,7 @@
 # this program. If not, see <http://www.gnu.org/licenses/>.
 #
 
-import matplotlib.pyplot as plt
+import numpy
 from numpy import exp, pi, sqrt
 import random
 import sys
@@ -30,45 +30,58 @@ from scheduling import Settings
 import scheduling
 
 
+def decision_density(alpha, red_time, slackness):
+    """The Time/Slackness decision density.
+
+    Arguments:
+    alpha -- factor for the slackness part of the density
+    red_time -- basically (current time / maximum admissible time)
+    slackness -- the so called slackness
+
+    Both red_time and slackness can also be arrays of the same shape.
+
+    """
+    p1 = red_time**42
+    p2 = alpha * (.1 + 2 * ((0 < slackness) & (slackness < 1)))
+    #p2 = slackness if slackness < 1 else max(2 - slackness, 0)
+    #p2 = max(0, slackness * (2 - slackness))
+    return p1 + (1 - p1) * p2
+
+
 class Scheduler(scheduling.Scheduler):
 
     """Scheduler using the Time/Slackness policy."""
 
-    def __init__(self, alpha):
+    def __init__(self, alpha, scenario=None):
         """Initiate a new scheduler.
 
             alpha: factor for the slackness part of the density.
+            scenario: Scenario instance (defaults to Settings.get_scenario()).
 
         """
-        scheduling.Scheduler.__init__(self)
+        scheduling.Scheduler.__init__(self, scenario)
         self.alpha = alpha
 
     def decision_density(self, red_time, slackness):
-        """The Time/Slackness decision density.
-
-        Arguments:
-        red_time -- basically (current time / maximum admissible time)
-        slackness -- the so called slackness
-
-        """
-        p1 = red_time**42
-        p2 = self.alpha * (.1 + 2 * (0 < slackness < 1))
-        #p2 = slackness if slackness < 1 else max(2 - slackness, 0)
-        #p2 = max(0, slackness * (2 - slackness))
-        return p1 + (1 - p1) * p2
+        """The Time/Slackness decision density (see decision_density)."""
+        return decision_density(self.alpha, red_time, slackness)
 
     def schedule_tasks(self):
         """Schedule all tasks using the Time/Slackness heuristic."""
-        next_tasks = list(Settings.tasks)
-        for t in range(Settings.nb_slots):
+        scenario = self.scenario
+        next_tasks = list(scenario.tasks)
+        for t in range(scenario.nb_slots):
             prev_cost = self.load_profile.get_load(t-1)
             cur_tasks = next_tasks
             next_tasks = []
+            if self.stats is not None:
+                self.stats.count('admission_attempts', len(cur_tasks))
             for task in cur_tasks:
-                red_time = t / float(Settings.nb_slots - task.nb_slots)
+                window = scenario.nb_slots - task.nb_slots
+                red_time = t / float(window) if window > 0 else 1.
                 task_area = float(task.inst_cost * task.nb_slots)
-                rev_cost = float(Settings.L - prev_cost)
-                rev_time = float(Settings.nb_slots - task.nb_slots - t)
+                rev_cost = float(scenario.L - prev_cost)
+                rev_time = float(scenario.nb_slots - task.nb_slots - t)
                 rev_area = rev_cost * rev_time
                 slackness = 0
                 if rev_area > 0:
@@ -80,8 +93,88 @@ class Scheduler(scheduling.Scheduler):
                     next_tasks.append(task)
 
 
-def sample_gc(alpha):
-    """Compute GC for a sample run."""
-    sched = Scheduler(alpha)
+class Policy:
+
+    """Time/Slackness policy for streams of jobs (see
+    streaming.StreamScheduler)."""
+
+    def __init__(self, alpha, scenario=None):
+        """Initiate a new policy.
+
+        Arguments:
+        alpha -- factor for the slackness part of the density
+        scenario -- Scenario instance (defaults to Settings.get_scenario())
+
+        """
+        self.scenario = scenario or Settings.get_scenario()
+        self.alpha = alpha
+
+    def plan(self, job, t, ring):
+        """Start job at slot t with the Time/Slackness probability."""
+        task_area = float(job.inst_cost * job.nb_slots)
+        rev_cost = self.scenario.L - ring.get_load(t - 1)
+        rev_area = rev_cost * (job.deadline - t)
+        slackness = task_area / rev_area if rev_area > 0 else 0
+        density = decision_density(self.alpha, job.red_time(t), slackness)
+        return t if random.uniform(0, 1) < density else None
+
+
+def sample_loads(alpha, replicas, scenario=None, stats=None):
+    """Draw the load profiles of several independent runs at once.
+
+    Arguments:
+    alpha -- factor for the slackness part of the density
+    replicas -- number of independent runs
+    scenario -- Scenario instance (defaults to Settings.get_scenario())
+    stats -- scheduling.Stats instance counting admission attempts
+
+    Returns an array of shape (replicas, nb_slots).
+
+    """
+    scenario = scenario or Settings.get_scenario()
+    nums, taus, costs = scheduling.pack_arrays(scenario)
+    task_area = costs * taus
+    windows = scenario.nb_slots - taus
+    def admission_probs(t, prev_cost):
+        red_time = numpy.where(windows > 0,
+                               t / numpy.maximum(windows, 1).astype(float), 1.)
+        rev_cost = scenario.L - prev_cost[:, numpy.newaxis]
+        rev_time = scenario.nb_slots - taus - t
+        rev_area = rev_cost * rev_time
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            slackness = numpy.where(rev_area > 0, task_area / rev_area, 0.)
+        return decision_density(alpha, red_time, slackness)
+    return scheduling.step_replicas(scenario, replicas, admission_probs,
+                                    stats)
+
+def sample_gc(alpha, replicas=None, scenario=None):
+    """Compute GC for a sample run.
+
+    Arguments:
+    alpha -- factor for the slackness part of the density
+    replicas -- if set, return the GCs of that many independent runs
+    scenario -- Scenario instance (defaults to Settings.get_scenario())
+
+    """
+    if replicas is not None:
+        loads = sample_loads(alpha, replicas, scenario)
+        return scheduling.gc_from_loads(loads, scenario)
+    sched = Scheduler(alpha, scenario)
     sched.schedule_tasks()
     return sched.get_global_cost()
+
+def sample_par(alpha, replicas=None, scenario=None):
+    """Compute the PAR for a sample run.
+
+    Arguments:
+    alpha -- factor for the slackness part of the density
+    replicas -- if set, return the PARs of that many independent runs
+    scenario -- Scenario instance (defaults to Settings.get_scenario())
+
+    """
+    if replicas is not None:
+        return scheduling.par_from_loads(sample_loads(alpha, replicas,
+                                                      scenario))
+    sched = Scheduler(alpha, scenario)
+    sched.schedule_tasks()
+    return sched.load_profile.get_par()
@@ -20,9 +20,11 @@
 # this program. If not, see <http://www.gnu.org/licenses/>.
 #
 
+import fractions
 import numpy
 import random
 import sys
+from numpy import sqrt
 
 sys.path.append('..')
 from scheduling import Settings
@@ -33,24 +35,329 @@ class Scheduler(scheduling.Scheduler):
 
     """Scheduler for the Uniform policy."""
 
-    def __init__(self):
-        scheduling.Scheduler.__init__(self)
+    def __init__(self, scenario=None):
+        scheduling.Scheduler.__init__(self, scenario)
 
     def schedule_tasks(self):
         """Schedule all tasks uniformly at random."""
-        for task in Settings.tasks:
-            time_slot = random.randint(0, Settings.nb_slots - task.nb_slots)
-            self.schedule_task(task, time_slot)
+        tasks = self.scenario.tasks
+        randslot = lambda task: \
+            random.randint(0, self.scenario.nb_slots - task.nb_slots)
+        self.schedule_many(tasks, map(randslot, tasks))
 
 
-def sample_gc():
-    """Compute GC for a sample run."""
-    sched = Scheduler()
+class Policy:
+
+    """Uniform policy for streams of jobs (see streaming.StreamScheduler)."""
+
+    def plan(self, job, t, ring):
+        """Start job uniformly at random among its admissible slots."""
+        return random.randint(t, job.deadline)
+
+
+def sample_loads(replicas, scenario=None, antithetic=False):
+    """Draw the load profiles of several independent runs at once.
+
+    Jobs of a pack are identical, so the number of jobs of each pack starting
+    at each slot is drawn from a multinomial law, then load profiles are built
+    from difference arrays.
+
+    Antithetic runs come in pairs: the second run of a pair delays every job
+    of the first one by half its number of admissible start slots (modulo
+    that number), so that the peaks of one run tend to be the valleys of the
+    other and their GCs are negatively correlated.
+
+    Arguments:
+    replicas -- number of runs (even if antithetic)
+    scenario -- Scenario instance (defaults to Settings.get_scenario())
+    antithetic -- draw replicas / 2 pairs of antithetic runs, the two runs of
+        a pair being consecutive rows
+
+    Returns an array of shape (replicas, nb_slots).
+
+    """
+    scenario = scenario or Settings.get_scenario()
+    S = scenario.nb_slots
+    if antithetic and replicas % 2 == 1:
+        raise Exception("Antithetic runs come in pairs.")
+    diff = numpy.zeros((replicas, S + 1))
+    for pack in scenario.packs:
+        nb_starts = S - pack.nb_slots + 1
+        pvals = numpy.ones(nb_starts) / nb_starts
+        counts = numpy.random.multinomial(pack.num, pvals, size=replicas / 2
+                                          if antithetic else replicas)
+        if antithetic:
+            counts = numpy.repeat(counts, 2, axis=0)
+            counts[1::2] = numpy.roll(counts[1::2], nb_starts / 2, axis=1)
+        diff[:, :nb_starts] += pack.inst_cost * counts
+        diff[:, pack.nb_slots:] -= pack.inst_cost * counts
+    return numpy.cumsum(diff, axis=1)[:, :S]
+
+def _cover(pack, nb_slots):
+    """Probability that a job of a pack covers each slot."""
+    nb_starts = nb_slots - pack.nb_slots + 1
+    return numpy.convolve(numpy.ones(nb_starts),
+                          numpy.ones(pack.nb_slots)) / nb_starts
+
+def load_moments(scenario=None):
+    """Compute the expected value and variance of the load of each slot.
+
+    A job of duration tau covers slot t with probability c(t) / (nb_slots -
+    tau + 1), where c(t) is the number of its start slots covering t, and jobs
+    start independently.
+
+    Returns the arrays of means and variances of slot loads.
+
+    """
+    scenario = scenario or Settings.get_scenario()
+    S = scenario.nb_slots
+    means, variances = numpy.zeros(S), numpy.zeros(S)
+    for pack in scenario.packs:
+        cover = _cover(pack, S)
+        means += pack.num * pack.inst_cost * cover
+        variances += pack.num * pack.inst_cost**2 * cover * (1 - cover)
+    return means, variances
+
+def controls(loads, scenario=None):
+    """Compute control variates of load profiles, whose expectations are
+    known (see control_means): the sum of squared slot loads and the total
+    load of the slots whose expected load exceeds L.
+
+    Arguments:
+    loads -- array of shape (nb_slots,) or (nb_runs, nb_slots)
+    scenario -- Scenario instance (defaults to Settings.get_scenario())
+
+    Returns an array of shape (2,) or (nb_runs, 2).
+
+    """
+    scenario = scenario or Settings.get_scenario()
+    loads = numpy.asarray(loads, dtype=float)
+    over = load_moments(scenario)[0] > scenario.L
+    return numpy.stack(((loads**2).sum(axis=-1),
+                        loads[..., over].sum(axis=-1)), axis=-1)
+
+def control_means(scenario=None):
+    """Expected values of the control variates of the Uniform policy."""
+    scenario = scenario or Settings.get_scenario()
+    means, variances = load_moments(scenario)
+    return numpy.array([(variances + means**2).sum(),
+                        means[means > scenario.L].sum()])
+
+def _lattice(costs, span, max_cells):
+    """Choose the step of a lattice of loads.
+
+    The step is the largest one dividing all instant costs (up to 6 decimals),
+    unless a span of loads would then cover more than max_cells steps, in
+    which case the step is widened.
+
+    """
+    costs = numpy.asarray(costs, dtype=float)
+    for decimals in range(7):
+        scaled = costs * 10**decimals
+        if numpy.allclose(scaled, numpy.round(scaled), rtol=0., atol=1e-6):
+            scaled = numpy.round(scaled).astype(numpy.int64)
+            step = 10.**-decimals * reduce(fractions.gcd, scaled)
+            break
+    else:
+        step = 0.
+    return max(step, span / max_cells)
+
+def _deviation(variance, max_cost):
+    """Deviation from its mean that a sum of independent variables of given
+    variance, each within max_cost of its mean, exceeds with probability less
+    than exp(-40) (Bernstein's inequality)."""
+    return 40. * max_cost / 3 + sqrt((40. * max_cost / 3)**2 + 80. * variance)
+
+def load_distributions(scenario=None, max_cells=2**12):
+    """Compute the distribution of the load of each slot.
+
+    A job of duration tau covers slot t with probability c(t), independently
+    of the other jobs (see load_moments). On a lattice of step h dividing all
+    instant costs, the discrete Fourier transform of the probability mass
+    function of the load of slot t is then the product over jobs of (1 - c(t)
+    + c(t) * z**(d / h)), z running over the n-th roots of unity, where d is
+    the instant cost of the job. Jobs of the same duration and instant cost
+    are grouped in classes, whose factors are raised to the power of their
+    sizes, and an inverse FFT yields the masses of loads modulo n * h.
+
+    Loads farther from their mean than the Bernstein deviation bound (see
+    _deviation) have a negligible probability, so n only needs to cover this
+    window of loads, whatever the number of jobs. Slots with the same
+    covering probabilities share their distribution.
+
+    Arguments:
+    scenario -- Scenario instance (defaults to Settings.get_scenario())
+    max_cells -- bound on the number of lattice steps per window; finer
+        lattices are widened (see _lattice), and distributions are then
+        approximate: the jobs of a class whose instant cost falls between two
+        lattice points are split between them, in proportions that keep
+        their expected load
+
+    Returns the step h of the lattice, the list of the first lattice points
+    of the windows of slots, and the list of mass functions, one per slot,
+    the i-th probability being that of a load of h * (first + i).
+
+    """
+    scenario = scenario or Settings.get_scenario()
+    S = scenario.nb_slots
+    nums, taus, costs = scheduling.pack_arrays(scenario)
+    span = min(2 * _deviation(load_moments(scenario)[1].max(), costs.max()),
+               numpy.dot(nums, costs))
+    step = _lattice(costs, span, max_cells)
+    lows = numpy.floor(costs / step + 1e-9)
+    fracs = numpy.maximum(costs / step - lows, 0.)
+    taus = numpy.concatenate((taus, taus))
+    steps = numpy.concatenate((lows, lows + 1)).astype(numpy.int64)
+    keys = taus.astype(numpy.int64) * (steps.max() + 1) + steps
+    keys, inverse = numpy.unique(keys, return_inverse=True)
+    sizes = numpy.bincount(inverse, weights=numpy.concatenate(
+        (nums * (1 - fracs), nums * fracs)))
+    taus, steps = keys // (steps.max() + 1), keys % (steps.max() + 1)
+    firsts, pmfs, known = [], [], {}
+    for t in range(S):
+        covers = (numpy.minimum(t, S - taus) - numpy.maximum(0, t - taus + 1)
+                  + 1.) / (S - taus + 1)
+        key = covers.tostring()
+        if key not in known:
+            on = (covers > 0.) & (sizes > 0) & (steps > 0)
+            c, k, m = covers[on], steps[on], sizes[on]
+            mean = numpy.dot(m * c, k)
+            dev = _deviation(numpy.dot(m * c * (1 - c), k**2.),
+                             k.max() if len(k) > 0 else 0)
+            first = max(0, int(mean - dev))
+            last = min(int(numpy.dot(m, k)), int(numpy.ceil(mean + dev)))
+            n = 1 << (last - first).bit_length()
+            freqs = numpy.arange(n // 2 + 1)
+            roots = numpy.exp(-2j * numpy.pi * numpy.arange(n) / n)
+            log_modulus, phase = numpy.zeros((2, n // 2 + 1))
+            chunk = max(1, 2**22 / len(freqs))
+            for i in range(0, len(c), chunk):
+                factors = 1. - c[i:i + chunk, numpy.newaxis] + \
+                    c[i:i + chunk, numpy.newaxis] * \
+                    roots[k[i:i + chunk, numpy.newaxis] * freqs % n]
+                with numpy.errstate(divide='ignore'):
+                    log_modulus += m[i:i + chunk].dot(numpy.log(abs(factors)))
+                phase += m[i:i + chunk].dot(numpy.angle(factors))
+            spectrum = numpy.exp(log_modulus + 1j * phase)
+            pmf = numpy.fft.irfft(spectrum, n)
+            pmf = numpy.maximum(pmf[numpy.arange(first, last + 1) % n], 0.)
+            known[key] = first, pmf / pmf.sum()
+        firsts.append(known[key][0])
+        pmfs.append(known[key][1])
+    return step, firsts, pmfs
+
+def expected_gc(scenario=None, max_cells=2**12):
+    """Compute the expected GC of the Uniform policy without simulation.
+
+    GC is a sum over slots of a function of the slot load (see
+    scheduling.gc_from_loads), so its expectation only depends on the
+    distributions of slot loads (see load_distributions).
+
+    Arguments:
+    scenario -- Scenario instance (defaults to Settings.get_scenario())
+    max_cells -- see load_distributions
+
+    """
+    scenario = scenario or Settings.get_scenario()
+    step, firsts, pmfs = load_distributions(scenario, max_cells)
+    return sum(pmf.dot(scheduling.gc_from_loads(
+        step * numpy.arange(first, first + len(pmf))[:, numpy.newaxis],
+        scenario)) for (first, pmf) in zip(firsts, pmfs))
+
+def _survivals(firsts, pmfs):
+    """Probabilities P(load >= step * i) of every slot, on a common grid."""
+    size = max(first + len(pmf) for (first, pmf) in zip(firsts, pmfs))
+    survivals = numpy.zeros((len(pmfs), size + 1))
+    for (survival, first, pmf) in zip(survivals, firsts, pmfs):
+        survival[:first] = 1.
+        survival[first:first + len(pmf)] = pmf[::-1].cumsum()[::-1]
+    return survivals
+
+def par_tail(x, scenario=None, max_cells=2**12):
+    """Bound the probability that the PAR of the Uniform policy reaches x.
+
+    The total load does not depend on the schedule, so PAR >= x if and only
+    if some slot load reaches x times the average load. The probability of
+    this union of events is at least that of the likeliest event, and at most
+    the sum of their probabilities.
+
+    Arguments:
+    x -- PAR threshold
+    scenario -- Scenario instance (defaults to Settings.get_scenario())
+    max_cells -- see load_distributions
+
+    Returns the lower and upper bounds on P(PAR >= x).
+
+    """
+    scenario = scenario or Settings.get_scenario()
+    step, firsts, pmfs = load_distributions(scenario, max_cells)
+    survivals = _survivals(firsts, pmfs)
+    mean_load = load_moments(scenario)[0].mean()
+    i = min(int(numpy.ceil(x * mean_load / step - 1e-9)),
+            survivals.shape[1] - 1)
+    return survivals[:, i].max(), min(1., survivals[:, i].sum())
+
+def par_bounds(scenario=None, max_cells=2**12):
+    """Bound the expected PAR of the Uniform policy.
+
+    The expected peak load is the sum over lattice points of the probability
+    that the peak reaches them, which is bounded as in par_tail.
+
+    Arguments:
+    scenario -- Scenario instance (defaults to Settings.get_scenario())
+    max_cells -- see load_distributions
+
+    Returns the lower and upper bounds on the expected PAR.
+
+    """
+    scenario = scenario or Settings.get_scenario()
+    step, firsts, pmfs = load_distributions(scenario, max_cells)
+    survivals = _survivals(firsts, pmfs)[:, 1:]
+    mean_load = load_moments(scenario)[0].mean()
+    lower = step * survivals.max(axis=0).sum()
+    upper = step * numpy.minimum(1., survivals.sum(axis=0)).sum()
+    return lower / mean_load, upper / mean_load
+
+def sample_gc(replicas=None, scenario=None, antithetic=False):
+    """Compute GC for a sample run.
+
+    Arguments:
+    replicas -- if set, return the GCs of that many independent runs
+    scenario -- Scenario instance (defaults to Settings.get_scenario())
+    antithetic -- in batch mode, draw pairs of antithetic runs (see
+        sample_loads)
+
+    """
+    if replicas is not None:
+        loads = sample_loads(replicas, scenario, antithetic)
+        return scheduling.gc_from_loads(loads, scenario)
+    sched = Scheduler(scenario)
     sched.schedule_tasks()
     return sched.get_global_cost()
 
-def sample_par():
-    """Compute the PAR for a sample run."""
-    sched = Scheduler()
+def sample_gc_controls(replicas, scenario=None, antithetic=False):
+    """Compute GC and the control variates of several runs.
+
+    Arguments are those of sample_gc, and the control variates those of
+    controls. Their expectations are given by control_means.
+
+    Returns an array of shape (replicas, 3), whose first column is GC.
+
+    """
+    loads = sample_loads(replicas, scenario, antithetic)
+    return numpy.column_stack((scheduling.gc_from_loads(loads, scenario),
+                               controls(loads, scenario)))
+
+def sample_par(replicas=None, scenario=None):
+    """Compute the PAR for a sample run.
+
+    Arguments:
+    replicas -- if set, return the PARs of that many independent runs
+    scenario -- Scenario instance (defaults to Settings.get_scenario())
+
+    """
+    if replicas is not None:
+        return scheduling.par_from_loads(sample_loads(replicas, scenario))
+    sched = Scheduler(scenario)
     sched.schedule_tasks()
     return sched.load_profile.get_par()
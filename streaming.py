@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# streaming.py
+# This file is part of DR StratComp.
+#
+# Copyright (C) 2010 - Stéphane Caron
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import numpy
+import time
+
+from scheduling import Settings, Task
+from trials import Moments
+
+"""Rolling-horizon scheduling of jobs arriving continuously.
+
+Time is an endless sequence of slots of the scenario's duration. A job
+arriving at slot a must run within the next nb_slots slots, i.e. start at
+some slot of [a, a + nb_slots - tau]. At each slot, a policy decides the start
+slot of arrived jobs, or defers them to the next slot. Slots are retired
+(their cost added to GC) as soon as no decision can change them, so memory
+only depends on nb_slots, however long the run.
+
+Policies are the plan(job, t, ring) objects of the strats modules, e.g.
+strats.aloha.Policy.
+
+"""
+
+
+class Job(Task):
+
+    """Task arriving at a given time slot."""
+
+    def __init__(self, id, d, tau, arrival, horizon):
+        """Constructor for a job.
+
+        Arguments:
+        id -- unique identifier
+        d -- instant cost
+        tau -- duration (number of slots)
+        arrival -- arrival time slot
+        horizon -- number of slots within which the job must run
+
+        """
+        Task.__init__(self, id, d, tau)
+        self.arrival = arrival
+        self.deadline = arrival + horizon - tau
+
+    def red_time(self, t):
+        """Fraction of the admissible start slots already passed at slot t."""
+        return float(t - self.arrival) / max(1, self.deadline - self.arrival)
+
+
+class RingProfile:
+
+    """Instant loads of a sliding window of time slots.
+
+    Loads are stored in a circular buffer indexed by absolute slots modulo its
+    size. Slots before start have been retired and slots from start + size on
+    cannot be loaded yet.
+
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.inst_load = numpy.zeros(size)
+        self.start = 0
+        self.last_retired = 0.
+
+    def add_load(self, slot_len, inst_cost, time_slot):
+        """Add load on a time slot interval (absolute slots)."""
+        if time_slot < self.start or \
+                time_slot + slot_len > self.start + self.size:
+            raise Exception("Invalid scheduling.")
+        i = time_slot % self.size
+        j = i + slot_len
+        self.inst_load[i:min(j, self.size)] += inst_cost
+        if j > self.size:
+            self.inst_load[:j - self.size] += inst_cost
+
+    def get_load(self, time_slot):
+        """Get the instant load of an absolute time slot.
+
+        The load of the last retired slot is still available, as the
+        strategies look at the load of the previous slot.
+
+        """
+        if time_slot == self.start - 1:
+            return self.last_retired
+        if time_slot < self.start or time_slot >= self.start + self.size:
+            return 0.
+        return self.inst_load[time_slot % self.size]
+
+    def window(self, time_slot, nb_slots):
+        """Get the loads of nb_slots absolute slots from time_slot on."""
+        indices = numpy.arange(time_slot, time_slot + nb_slots) % self.size
+        return self.inst_load[indices]
+
+    def retire(self):
+        """Retire the first slot of the window and return its load."""
+        i = self.start % self.size
+        self.last_retired = self.inst_load[i]
+        self.inst_load[i] = 0.
+        self.start += 1
+        return self.last_retired
+
+
+def poisson_arrivals(rate, nb_slots=None, scenario=None, seed=None):
+    """Generate a stream of jobs drawn from the packs of a scenario.
+
+    The number of arrivals per slot is Poisson distributed and each job
+    copies the duration and instant cost of a pack, chosen with probability
+    proportional to its size.
+
+    Arguments:
+    rate -- average number of arrivals per slot
+    nb_slots -- number of slots of the stream (endless if None)
+    scenario -- Scenario instance (defaults to Settings.get_scenario())
+    seed -- seed of the stream
+
+    Yields Job instances, in order of arrival.
+
+    """
+    scenario = scenario or Settings.get_scenario()
+    rs = numpy.random.RandomState(seed)
+    nums, taus, costs = scenario.arrays
+    weights = numpy.asarray(nums, float) / numpy.sum(nums)
+    next_id, t = 0, 0
+    while nb_slots is None or t < nb_slots:
+        for k in rs.choice(len(weights), rs.poisson(rate), p=weights):
+            yield Job(next_id, float(costs[k]), int(taus[k]), t,
+                      scenario.nb_slots)
+            next_id += 1
+        t += 1
+
+
+class StreamScheduler:
+
+    """Rolling-horizon scheduler of a stream of jobs."""
+
+    def __init__(self, policy, scenario=None):
+        """Initiate a new scheduler.
+
+        Arguments:
+        policy -- object whose plan(job, t, ring) method returns the start
+            slot of job decided at slot t, or None to decide later
+        scenario -- Scenario instance giving L, C0, C1, the slot duration and
+            the horizon nb_slots of jobs (defaults to Settings.get_scenario())
+
+        """
+        self.policy = policy
+        self.scenario = scenario or Settings.get_scenario()
+        self.ring = RingProfile(self.scenario.nb_slots)
+        self.global_cost = 0.
+        self.peak_load = 0.
+        self.nb_jobs = 0
+        self.nb_slots = 0
+        self.latency = Moments()
+        self.max_latency = 0.
+        self.seconds = 0.
+
+    def _decide(self, job, t):
+        start = time.time()
+        slot = self.policy.plan(job, t, self.ring)
+        if slot is None and t == job.deadline:
+            slot = t
+        elapsed = time.time() - start
+        self.latency.add(elapsed)
+        self.max_latency = max(self.max_latency, elapsed)
+        if slot is not None:
+            self.ring.add_load(job.nb_slots, job.inst_cost, slot)
+            self.nb_jobs += 1
+        return slot is not None
+
+    def _retire(self):
+        sc = self.scenario
+        load = self.ring.retire()
+        dt = sc.T / sc.nb_slots
+        self.global_cost += dt * (sc.C0 + sc.C1 * max(load - sc.L, 0.)) * load
+        self.peak_load = max(self.peak_load, load)
+        self.nb_slots += 1
+
+    def run(self, jobs, nb_slots=None):
+        """Schedule a stream of jobs.
+
+        Arguments:
+        jobs -- iterable of Job instances, in order of arrival
+        nb_slots -- stop after this many slots (default: when the stream is
+            exhausted and all jobs have run)
+
+        Returns the report of the run (see report).
+
+        """
+        jobs = iter(jobs)
+        pending = []
+        start = time.time()
+        next_job = next(jobs, None)
+        t = self.ring.start
+        while nb_slots is None or t < nb_slots:
+            while next_job is not None and next_job.arrival <= t:
+                pending.append(next_job)
+                next_job = next(jobs, None)
+            pending = [job for job in pending if not self._decide(job, t)]
+            if next_job is None and not pending and nb_slots is None:
+                while self.ring.inst_load.any():
+                    self._retire()
+                break
+            self._retire()
+            t += 1
+        self.seconds += time.time() - start
+        return self.report()
+
+    def report(self):
+        """Get a dictionary of cost, throughput and latency figures."""
+        return {'jobs': self.nb_jobs, 'slots': self.nb_slots,
+                'global_cost': self.global_cost, 'peak_load': self.peak_load,
+                'seconds': self.seconds,
+                'throughput': self.nb_jobs / max(self.seconds, 1e-9),
+                'decisions': self.latency.count,
+                'latency_mean': self.latency.mean,
+                'latency_std': self.latency.std(),
+                'latency_max': self.max_latency}
+
+################################################################################
+
+if __name__ == "__main__":
+    import sys
+    from strats import aloha, game, timeslack, uniform
+    Settings.from_file(sys.argv[1] if len(sys.argv) > 1 else
+                       'residential.in')
+    scenario = Settings.get_scenario()
+    days = 7
+    nb_slots = days * 4 * scenario.nb_slots
+    rate = sum(p.num for p in scenario.packs) / float(scenario.nb_slots)
+    policies = [('Uniform', uniform.Policy()),
+                ('ALOHA-like I', aloha.Policy(.2, 0)),
+                ('Time/Slackness', timeslack.Policy(.06)),
+                ('Game', game.Policy())]
+    for (label, policy) in policies:
+        sched = StreamScheduler(policy, scenario)
+        r = sched.run(poisson_arrivals(rate, nb_slots, scenario, seed=42))
+        print '%-15s %7d jobs  GC/day %9.2f  peak %8.1f  %8.0f jobs/s  ' \
+            'latency %.1f us (max %.1f us)' % (
+                label, r['jobs'], r['global_cost'] / days, r['peak_load'],
+                r['throughput'], 1e6 * r['latency_mean'],
+                1e6 * r['latency_max'])
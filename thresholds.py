@@ -20,83 +20,115 @@
 # this program. If not, see <http://www.gnu.org/licenses/>.
 #
 
-import matplotlib.pyplot as pyplot
 import numpy
 import time
 
+from functools import partial
 from scheduling import Settings
 from strats import aloha, game, timeslack, uniform
 import trials
 
 """Sample test script to find good values of the heuristics' parameters."""
 
-def generic_errorbar(xvals, niter, format, samplefun):
-    """Plot errorbars for several runs of an argumentless numerical function.
 
-    Arguments:
-    xvals -- domain for the x-axis of the plot
-    niter -- number of runs per argument in xvals
-    format -- pyplot format for the errorbars
-    samplefun -- numerical function with no argument
+# Default number of runs per point of each policy in a sweep.
 
-    """
-    mean, dev = trials.get_first_moments(niter, samplefun)
-    means, devs = [mean for x in xvals], [dev for x in xvals]
-    eb, _, _ = pyplot.errorbar(xvals, means, yerr=devs, lw=2)
-    return eb
+NITERS = {'Game': 20, 'ALOHA-like I': 100, 'ALOHA-like II': 100,
+          'Time/Slackness': 100}
+
+def aloha1_gc(thr, replicas=None, scenario=None):
+    """Sample GC of the ALOHA-like I policy with threshold thr."""
+    return aloha.sample_gc(thr, 0, replicas, scenario)
+
+def aloha2_gc(thr, replicas=None, scenario=None):
+    """Sample GC of the ALOHA-like II policy with threshold thr."""
+    return aloha.sample_gc(thr, .1 * thr, replicas, scenario)
+
+def sweep_table(xvals, niters, seed=None, processes=None, cache=None):
+    """Run the Game baseline and the parameter sweeps of the ALOHA-like I/II
+    and Time/Slackness policies on a single worker pool.
 
-def uniform_errorbar(xvals, niter):
-    """Plot errorbars for the Uniform strategy."""
-    return generic_errorbar(xvals, niter, 'm-', uniform.sample_gc)
+    The Uniform baseline is not simulated: its expected GC is computed
+    exactly (see strats.uniform.expected_gc), and its row has no standard
+    deviation (None) and no run.
 
-def game_errorbar(xvals, niter):
-    """Plot errorbars for the Game strategy."""
-    return generic_errorbar(xvals, niter, 'r-', game.sample_gc)
+    Arguments:
+    xvals -- domain for the parameters of the swept policies
+    niters -- dictionary giving the number of runs per point of each
+        simulated policy
+    seed -- master seed of the runs (random if None)
+    processes -- number of worker processes (None: one per CPU)
+    cache -- cache.ResultCache reused across calls with the same seed
+
+    Returns the table of rows computed by trials.run_sweep.
+
+    """
+    scenario = Settings.get_scenario()
+    fix = lambda fun: partial(fun, scenario=scenario)
+    series = [
+        ('Game', fix(game.sample_gc), None, niters['Game'], False),
+        ('ALOHA-like I', fix(aloha1_gc), xvals, niters['ALOHA-like I'],
+         True),
+        ('ALOHA-like II', fix(aloha2_gc), xvals, niters['ALOHA-like II'],
+         True),
+        ('Time/Slackness', fix(timeslack.sample_gc), xvals,
+         niters['Time/Slackness'], True)]
+    uni_row = {'strategy': 'Uniform', 'param': None,
+               'mean': uniform.expected_gc(scenario), 'std': None, 'count': 0}
+    return [uni_row] + trials.run_sweep(series, seed, processes, cache)
+
+def get_rows(table, label):
+    """Select the rows of a sweep table for a given policy."""
+    return [row for row in table if row['strategy'] == label]
 
 ################################################################################
 
-def param_errorbar(xvals, niter, samplefun, color):
-    """Plot errorbars for several runs of samplefun.
+def generic_errorbar(xvals, table, label):
+    """Plot errorbars for a policy without parameter.
 
     Arguments:
-    xvals -- domain for the arguments of samplefun
-    niter -- number of runs per argument in xvals
-    format -- pyplot format for the errorbars
-    samplefun -- numerical one-argument function
+    xvals -- domain for the x-axis of the plot
+    table -- sweep table (see sweep_table)
+    label -- name of the policy in the table
 
     """
-    moments = [trials.get_first_moments(niter, samplefun(x)) for x in xvals]
-    yvals = [mmt[0] for mmt in moments]
-    devs = [mmt[1] for mmt in moments]
-    eb, w1, w2 = pyplot.errorbar(xvals, yvals, yerr=devs, marker='o')
+    import matplotlib.pyplot as pyplot
+    row = get_rows(table, label)[0]
+    means = [row['mean'] for x in xvals]
+    devs = [row['std'] for x in xvals] if row['std'] is not None else None
+    eb, _, _ = pyplot.errorbar(xvals, means, yerr=devs, lw=2)
     return eb
 
-def aloha_errorbar(xvals, niter):
-    """Plot errorbars for the ALOHA-like I policy."""
-    samplefun = lambda thr: (lambda: aloha.sample_gc(thr, 0))
-    return param_errorbar(xvals, niter, samplefun, 'g')
+def param_errorbar(table, label):
+    """Plot errorbars for a policy swept over its parameter.
 
-def aloha2_errorbar(xvals, niter):
-    """Plot errorbars for the ALOHA-like II policy."""
-    samplefun = lambda thr: (lambda: aloha.sample_gc(thr, .1 * thr))
-    return param_errorbar(xvals, niter, samplefun, 'orange')
+    Arguments:
+    table -- sweep table (see sweep_table)
+    label -- name of the policy in the table
 
-def timeslack_errorbar(xvals, niter):
-    """Plot errorbars for the Time/Slackness policy."""
-    samplefun = lambda alpha: (lambda: timeslack.sample_gc(alpha))
-    return param_errorbar(xvals, niter, samplefun, 'b')
+    """
+    import matplotlib.pyplot as pyplot
+    rows = get_rows(table, label)
+    xvals = [row['param'] for row in rows]
+    yvals = [row['mean'] for row in rows]
+    devs = [row['std'] for row in rows]
+    eb, w1, w2 = pyplot.errorbar(xvals, yvals, yerr=devs, marker='o')
+    return eb
 
-################################################################################
+def plot_sweep(xvals, table):
+    """Plot a sweep table, with one errorbar series per policy.
 
-if __name__ == "__main__":
-    Settings.from_file('twoplayers.in')
-    xvals = numpy.arange(0, 1.025, 0.025)
+    Arguments:
+    xvals -- domain for the parameters of the swept policies
+    table -- sweep table (see sweep_table)
 
-    uni_mrk = uniform_errorbar(xvals, niter=42)
-    game_mrk = game_errorbar(xvals, niter=20)
-    aloha_mrk = aloha_errorbar(xvals, niter=100)
-    aloha2_mrk = aloha2_errorbar(xvals, niter=100)
-    timeslack_mrk = timeslack_errorbar(xvals, niter=100)
+    """
+    import matplotlib.pyplot as pyplot
+    uni_mrk = generic_errorbar(xvals, table, 'Uniform')
+    game_mrk = generic_errorbar(xvals, table, 'Game')
+    aloha_mrk = param_errorbar(table, 'ALOHA-like I')
+    aloha2_mrk = param_errorbar(table, 'ALOHA-like II')
+    timeslack_mrk = param_errorbar(table, 'Time/Slackness')
 
     pyplot.legend([aloha_mrk, aloha2_mrk, uni_mrk, game_mrk, timeslack_mrk],
         ['ALOHA-like I', 'ALOHA-like II', 'Uniform', 'Game', 'TSD Density'],
@@ -106,4 +138,13 @@ if __name__ == "__main__":
     pyplot.xlabel('Param.')
     pyplot.title(Settings.file)
     pyplot.grid(True)
+
+################################################################################
+
+if __name__ == "__main__":
+    import matplotlib.pyplot as pyplot
+    Settings.from_file('twoplayers.in')
+    xvals = numpy.arange(0, 1.025, 0.025)
+    table = sweep_table(xvals, NITERS)
+    plot_sweep(xvals, table)
     pyplot.show()
@@ -20,24 +20,499 @@
 # this program. If not, see <http://www.gnu.org/licenses/>.
 #
 
+import itertools
+import multiprocessing
+import numpy
+import random
+import time
+from functools import partial
 from numpy import sqrt
 
+import scheduling
+
 """Statistics on multiple runs of given numerical functions."""
 
-def get_first_moments(niter, expfun):
+
+# Number of replicas per call of a batched function when replicas are
+# distributed among worker processes. It does not depend on the number of
+# workers, so that results do not either.
+
+_BATCH_SIZE = 50
+
+# Results of a cached run are stored at least this often (in seconds) while it
+# is in progress, so that an interrupted run resumes from its last results.
+
+CHECKPOINT_SECONDS = 30.
+
+
+class Moments:
+
+    """Streaming accumulator for the mean and variance of a sample.
+
+    Samples are folded in one at a time with Welford's update, or by blocks,
+    and two accumulators (e.g. from different workers) can be merged. The
+    sample itself is never stored.
+
+    The effective sample size ess is the number of plain independent runs
+    that would give the same confidence interval. It equals count unless the
+    samples come from a variance reduction (see reduce_variance).
+
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.
+        self.m2 = 0.
+        self.ess = 0.
+
+    def add(self, x):
+        """Add one sample value."""
+        self.count += 1
+        self.ess += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+    def add_many(self, xs):
+        """Add an array of sample values."""
+        xs = numpy.asarray(xs, dtype=float)
+        if len(xs) > 0:
+            block = Moments()
+            block.count = len(xs)
+            block.mean = xs.mean()
+            block.m2 = ((xs - block.mean)**2).sum()
+            block.ess = len(xs)
+            self.merge(block)
+
+    def merge(self, other):
+        """Fold the samples of another Moments instance into this one."""
+        count = self.count + other.count
+        if count == 0:
+            return
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta**2 * self.count * other.count / count
+        self.count = count
+        self.ess += other.ess
+
+    def std(self):
+        """Standard deviation of the sample."""
+        return sqrt(self.m2 / self.count) if self.count > 0 else 0.
+
+    def half_width(self, z=1.96):
+        """Half-width of the confidence interval on the mean.
+
+        Arguments:
+        z -- quantile of the normal law (1.96 for a 95% interval)
+
+        """
+        if self.count < 2:
+            return float('inf')
+        return z * sqrt(self.m2 / (self.count - 1) / self.count)
+
+    def moments(self):
+        """Mean and standard deviation, as returned by get_first_moments."""
+        return self.mean, self.std()
+
+
+def effective_size(count, plain_var, var):
+    """Number of plain runs giving the same precision as count runs of a
+    variance-reduced estimator.
+
+    Arguments:
+    count -- number of (reduced) samples
+    plain_var -- variance of plain samples
+    var -- variance of reduced samples
+
+    """
+    if var <= 0.:
+        return float('inf')
+    return count * plain_var / var
+
+def reduce_variance(samples, means=None, antithetic=False):
+    """Estimate a mean with control variates and antithetic pairs.
+
+    Control variates are quantities computed along each sample, correlated
+    with it and with known expectations. Their deviations from these
+    expectations, times coefficients fitted by least squares, are subtracted
+    from the samples, which keeps the mean and removes the part of the
+    variance they explain. Antithetic samples come in negatively correlated
+    pairs, whose averages are the reduced samples.
+
+    Arguments:
+    samples -- array of shape (n,), or (n, 1 + k) whose last k columns are
+        control variates
+    means -- known expectations of the k control variates (None: no control)
+    antithetic -- consecutive samples are antithetic pairs (n is even)
+
+    Returns a Moments instance of the reduced samples, whose ess is computed
+    with respect to the variance of the plain samples.
+
+    """
+    samples = numpy.asarray(samples, dtype=float)
+    ys = samples[:, 0] if samples.ndim == 2 else samples
+    plain_var = ys.var()
+    if means is not None:
+        devs = samples[:, 1:] - means
+        coefs = numpy.linalg.lstsq(devs - devs.mean(axis=0), ys - ys.mean(),
+                                   rcond=None)[0]
+        ys = ys - devs.dot(coefs)
+    if antithetic:
+        ys = (ys[0::2] + ys[1::2]) / 2
+    acc = Moments()
+    acc.add_many(ys)
+    acc.ess = effective_size(acc.count, plain_var, ys.var())
+    return acc
+
+def _check_cache(cache, seed):
+    """Refuse to cache runs without a master seed, which cannot be found
+    again."""
+    if cache is not None and seed is None:
+        raise Exception("Cached runs need a master seed.")
+
+def replica_seeds(niter, seed):
+    """Derive independent per-replica seeds from a master seed.
+
+    Arguments:
+    niter -- number of replicas
+    seed -- master seed
+
+    """
+    return list(numpy.random.RandomState(seed).randint(0, 2**31 - 1, niter))
+
+def _run_seeded(job):
+    """Call a function after seeding the random and numpy.random streams."""
+    expfun, seed, kwargs = job
+    random.seed(seed)
+    numpy.random.seed(seed)
+    return expfun(**kwargs)
+
+def _run_jobs(jobs, processes=1, pool=None, cache=None):
+    """Run (expfun, seed, kwargs) jobs, skipping those found in cache.
+
+    Results are stored in cache as they come, every CHECKPOINT_SECONDS, so
+    that running the same jobs again after an interruption only runs the
+    missing ones.
+
+    """
+    if cache is not None:
+        results = cache.lookup(jobs)
+    else:
+        results = [None] * len(jobs)
+    missing = [i for (i, result) in enumerate(results) if result is None]
+    todo = [jobs[i] for i in missing]
+    own_pool = pool is None and processes != 1 and len(todo) > 0
+    if own_pool:
+        pool = multiprocessing.Pool(processes)
+    try:
+        if cache is None:
+            done = (pool.map if pool is not None else map)(_run_seeded, todo)
+        else:
+            done = _run_stored(todo, pool, cache)
+    finally:
+        if own_pool:
+            pool.close()
+            pool.join()
+    for (i, result) in zip(missing, done):
+        results[i] = result
+    return results
+
+def _run_stored(jobs, pool, cache):
+    """Run jobs in order, storing their results in cache periodically."""
+    if pool is not None:
+        chunksize = max(1, len(jobs) / (4 * multiprocessing.cpu_count()))
+        runs = pool.imap(_run_seeded, jobs, chunksize)
+    else:
+        runs = itertools.imap(_run_seeded, jobs)
+    done, stored, last = [], 0, time.time()
+    for result in runs:
+        done.append(result)
+        if time.time() - last >= CHECKPOINT_SECONDS:
+            cache.store(jobs[stored:len(done)], done[stored:])
+            stored, last = len(done), time.time()
+    if stored < len(done):
+        cache.store(jobs[stored:], done[stored:])
+    return done
+
+def get_samples(niter, expfun, batch=False, seed=None, processes=1,
+                pool=None, cache=None):
+    """Run expfun several times and return the array of its results.
+
+    When a master seed is given, or when runs are spread over several
+    processes, each replica (or block of _BATCH_SIZE replicas in batch mode)
+    seeds the random and numpy.random streams with its own seed derived from
+    the master seed. Results are then identical whatever the number of
+    processes, and are returned in order.
+
+    Arguments:
+    niter -- number of runs
+    expfun -- numerical function to test, picklable if processes != 1
+    batch -- if True, expfun(replicas=n) returns n samples at once
+    seed -- master seed (drawn at random if None and processes != 1)
+    processes -- number of worker processes (None: one per CPU)
+    pool -- existing multiprocessing pool to use instead of processes
+    cache -- cache.ResultCache storing the results of seeded runs (needs a
+        master seed)
+
+    """
+    _check_cache(cache, seed)
+    if seed is None and processes == 1 and pool is None:
+        if batch:
+            return numpy.asarray(expfun(replicas=niter))
+        return numpy.array([expfun() for i in range(niter)])
+    if seed is None:
+        seed = numpy.random.randint(2**31 - 1)
+    if batch:
+        sizes = [_BATCH_SIZE] * (niter / _BATCH_SIZE)
+        if niter % _BATCH_SIZE > 0:
+            sizes.append(niter % _BATCH_SIZE)
+        kwargs = [{'replicas': size} for size in sizes]
+    else:
+        kwargs = [{}] * niter
+    seeds = replica_seeds(len(kwargs), seed)
+    jobs = [(expfun, s, kw) for (s, kw) in zip(seeds, kwargs)]
+    results = _run_jobs(jobs, processes, pool, cache)
+    if batch:
+        return numpy.concatenate(results)
+    return numpy.array(results)
+
+def _profile_run(make_sched):
+    """Profile one run of a new scheduler and export its statistics."""
+    return make_sched().profile().as_dict()
+
+def get_profiles(niter, make_sched, seed=None, processes=1):
+    """Profile several instrumented runs of a scheduler.
+
+    Arguments:
+    niter -- number of runs
+    make_sched -- function returning a new Scheduler instance, picklable if
+        processes != 1 (e.g. functools.partial(aloha.Scheduler, .2, 0))
+    seed -- master seed of the runs (see get_samples)
+    processes -- number of worker processes (None: one per CPU)
+
+    Returns the list of per-run statistics (as dictionaries) and a
+    scheduling.Stats instance aggregating all runs.
+
+    """
+    if seed is None:
+        seed = numpy.random.randint(2**31 - 1)
+    jobs = [(partial(_profile_run, make_sched), s, {})
+            for s in replica_seeds(niter, seed)]
+    runs = _run_jobs(jobs, processes)
+    total = scheduling.Stats.from_dict(runs[0])
+    for run in runs[1:]:
+        total.merge(scheduling.Stats.from_dict(run))
+    return runs, total
+
+def get_first_moments(niter, expfun, batch=False, seed=None, processes=1,
+                      cache=None):
     """Compute mean and standard deviation for multiple runs of expfun.
 
     Arguments:
     niter -- number of runs
     expfun -- numerical function to test
+    batch -- if True, expfun(replicas=niter) returns all samples at once
+    seed -- master seed of the runs (see get_samples)
+    processes -- number of worker processes (None: one per CPU)
+    cache -- cache.ResultCache storing the results of seeded runs (needs a
+        master seed)
+
+    """
+    _check_cache(cache, seed)
+    acc = Moments()
+    if batch or seed is not None or processes != 1:
+        acc.add_many(get_samples(niter, expfun, batch, seed, processes,
+                                 cache=cache))
+    else:
+        for i in range(niter):
+            acc.add(expfun())
+    return acc.moments()
+
+def get_adaptive_moments(expfun, rel_width=.02, batch=False, min_iter=10,
+                         max_iter=1000, max_time=None, step=None, seed=None,
+                         processes=1, cache=None, means=None,
+                         antithetic=False):
+    """Run expfun until the confidence interval on its mean is tight enough.
+
+    Runs are performed by rounds of step replicas. The driver stops as soon as
+    the half-width of the 95% confidence interval on the mean falls below
+    rel_width times the mean (after at least min_iter runs), or when the
+    replica budget max_iter or the time budget max_time is exhausted. Rounds
+    are seeded from the master seed, so that the result does not depend on
+    the number of processes.
+
+    With control variates or antithetic pairs, samples are kept and the
+    reduced moments (see reduce_variance) are recomputed after each round.
+
+    Arguments:
+    expfun -- numerical function to test
+    rel_width -- target relative half-width of the confidence interval
+    batch -- if True, expfun(replicas=n) returns n samples at once
+    min_iter -- minimum number of runs
+    max_iter -- maximum number of runs
+    max_time -- time budget in seconds (None for no limit)
+    step -- number of runs per round (default: min_iter, or _BATCH_SIZE in
+        batch mode)
+    seed -- master seed of the runs (see get_samples)
+    processes -- number of worker processes (None: one per CPU)
+    cache -- cache.ResultCache storing the results of seeded runs (needs a
+        master seed)
+    means -- expectations of the control variates returned by expfun after
+        each sample (see reduce_variance)
+    antithetic -- expfun returns antithetic pairs (batch mode only)
+
+    Returns a Moments instance.
+
+    """
+    _check_cache(cache, seed)
+    step = step or (_BATCH_SIZE if batch else min_iter)
+    if seed is None:
+        seed = numpy.random.randint(2**31 - 1)
+    round_seeds = replica_seeds(max_iter / step + 1, seed)
+    pool = multiprocessing.Pool(processes) if processes != 1 else None
+    acc, start = Moments(), time.time()
+    reduce = means is not None or antithetic
+    samples, nb_runs = [], 0
+    try:
+        for round_seed in round_seeds:
+            niter = min(step, max_iter - nb_runs)
+            if antithetic:
+                niter -= niter % 2
+            if niter <= 0:
+                break
+            samples.append(get_samples(niter, expfun, batch, round_seed,
+                                       pool=pool, cache=cache))
+            nb_runs += niter
+            if reduce:
+                acc = reduce_variance(numpy.concatenate(samples), means,
+                                      antithetic)
+            else:
+                acc.add_many(samples.pop())
+            if nb_runs >= min_iter and \
+                    acc.half_width() <= rel_width * abs(acc.mean):
+                break
+            if max_time is not None and time.time() - start > max_time:
+                break
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return acc
+
+def get_paired_moments(expfuns, niter, batch=False, seed=None, processes=1,
+                       cache=None):
+    """Compare functions on common random numbers.
+
+    Every function runs with the same replica seeds (see get_samples), so
+    that replica k of all functions draws the same random numbers. When
+    functions consume them alike, e.g. a policy at nearby parameter values,
+    their samples are positively correlated and their differences are
+    estimated with fewer runs than from independent samples. The effective
+    sample size tells how much was gained.
+
+    Arguments:
+    expfuns -- list of numerical functions, the first one being the
+        reference of the comparisons
+    niter -- number of runs per function
+    batch -- if True, expfun(replicas=n) returns n samples at once
+    seed -- master seed (drawn at random if None)
+    processes -- number of worker processes (None: one per CPU)
+    cache -- cache.ResultCache storing the results of seeded runs (needs a
+        master seed)
+
+    Returns a list of rows, one per function, each row being a dictionary
+    with keys 'mean', 'std' and 'count', and for all functions but the first
+    'diff', 'diff_half_width' (of the 95% confidence interval) and 'ess', the
+    effective sample size of the difference with respect to independent runs.
+
+    """
+    _check_cache(cache, seed)
+    if seed is None:
+        seed = numpy.random.randint(2**31 - 1)
+    pool = multiprocessing.Pool(processes) if processes != 1 else None
+    try:
+        samples = [get_samples(niter, expfun, batch, seed, pool=pool,
+                               cache=cache) for expfun in expfuns]
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    table = []
+    for xs in samples:
+        acc = Moments()
+        acc.add_many(xs)
+        row = {'mean': acc.mean, 'std': acc.std(), 'count': acc.count}
+        if len(table) > 0:
+            diff = Moments()
+            diff.add_many(xs - samples[0])
+            indep_var = xs.var() + samples[0].var()
+            row.update({'diff': diff.mean,
+                        'diff_half_width': diff.half_width(),
+                        'ess': effective_size(diff.count, indep_var,
+                                              diff.std()**2)})
+        table.append(row)
+    return table
+
+def run_sweep(series, seed=None, processes=1, cache=None):
+    """Run a (strategy x parameter x replica) grid of experiments.
+
+    All runs of the grid are scheduled together on the same worker pool, so
+    that baselines without parameter run concurrently with sweep points.
+    Replica k (or block k of _BATCH_SIZE replicas in batch mode) uses the same
+    seed for every parameter value: these common random numbers reduce the
+    variance of the differences between points of a sweep.
+
+    Arguments:
+    series -- list of (label, samplefun, params, niter, batch) tuples, where
+        samplefun(param) returns a sample (samplefun() if params is None),
+        niter is the number of runs per parameter value and batch is True if
+        samplefun(param, replicas=n) returns n samples at once
+    seed -- master seed (drawn at random if None)
+    processes -- number of worker processes (None: one per CPU)
+    cache -- cache.ResultCache storing the results of seeded runs (needs a
+        master seed)
+
+    Returns a list of rows, one per (label, param) pair in the order of
+    series, each row being a dictionary with keys 'strategy', 'param', 'mean',
+    'std' and 'count'.
 
     """
-    costs = [expfun() for i in range(niter)]
-    mean = sum(costs) / niter
-    var = sum([(c - mean)**2 for c in costs]) / niter
-    return mean, sqrt(var)
+    _check_cache(cache, seed)
+    if seed is None:
+        seed = numpy.random.randint(2**31 - 1)
+    max_jobs = max(niter for (_, _, _, niter, _) in series)
+    seeds = replica_seeds(max_jobs, seed)
+    keys, jobs = [], []
+    for (label, samplefun, params, niter, batch) in series:
+        if batch:
+            sizes = [_BATCH_SIZE] * (niter / _BATCH_SIZE)
+            if niter % _BATCH_SIZE > 0:
+                sizes.append(niter % _BATCH_SIZE)
+            kwargs = [{'replicas': size} for size in sizes]
+        else:
+            kwargs = [{}] * niter
+        for param in (params if params is not None else [None]):
+            fun = partial(samplefun, param) if params is not None \
+                else samplefun
+            for (s, kw) in zip(seeds, kwargs):
+                keys.append((label, param))
+                jobs.append((fun, s, kw))
+    results = _run_jobs(jobs, processes, cache=cache)
+    points, accs = [], {}
+    for (key, result) in zip(keys, results):
+        if key not in accs:
+            accs[key] = Moments()
+            points.append(key)
+        accs[key].add_many(numpy.atleast_1d(result))
+    table = []
+    for (label, param) in points:
+        acc = accs[(label, param)]
+        table.append({'strategy': label, 'param': param, 'mean': acc.mean,
+                      'std': acc.std(), 'count': acc.count})
+    return table
 
-def get_best_over(xvals, samplefun, niter, print_means=False):
+def get_best_over(xvals, samplefun, niter, print_means=False, batch=False,
+                  seed=None, processes=1):
     """Returns the best mean over multiple runs on each point of xvals.
 
     Arguments:
@@ -45,10 +520,14 @@ def get_best_over(xvals, samplefun, niter, print_means=False):
     samplefun -- numerical one-argument function
     niter -- number of iteration per argument in xvals
     print_means -- print means at each point of xvals
+    batch -- samplefun(x, replicas=n) returns n samples at once
+    seed -- master seed of the runs (see run_sweep)
+    processes -- number of worker processes (None: one per CPU)
 
     """
-    wrapfun = lambda thr: (lambda: samplefun(thr))
-    moments = [get_first_moments(niter, wrapfun(thr)) for thr in xvals]
+    table = run_sweep([('best', samplefun, xvals, niter, batch)], seed,
+                      processes)
+    moments = [(row['mean'], row['std']) for row in table]
     if print_means:
         print "get_best_over: means:", map(lambda m: m[0], moments)
     best_mean = min(m[0] for m in moments)